@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import sqlalchemy as sa
+import sqlalchemy.ext.declarative
+from fast_alchemy import FastAlchemy
+
+
+def build_schema(model_count, prefix='Model'):
+    raw = {}
+    for i in range(model_count):
+        raw['{}{}'.format(prefix, i)] = {
+            'ref': 'name',
+            'definition': {
+                'name': 'String',
+                'size': 'Integer',
+            },
+        }
+    return raw
+
+
+def build_fast_alchemy():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    return FastAlchemy(Base, sa.orm.scoped_session(Session))
+
+
+def time_drops(model_count, repeat):
+    fa = build_fast_alchemy()
+    fa.load_models(build_schema(model_count))
+
+    timings = []
+    for _ in range(repeat):
+        fa.load_models(build_schema(1, prefix='Dropped'))
+        start = time.perf_counter()
+        fa.drop_models(models=['Dropped0'])
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time dropping a single model next to a growing schema')
+    parser.add_argument(
+        '--model-counts', type=int, nargs='+', default=[10, 50, 100, 200])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print('{:>8} {:>12}'.format('models', 'drop (ms)'))
+    for model_count in args.model_counts:
+        timing = time_drops(model_count, args.repeat)
+        print('{:>8} {:>12.3f}'.format(model_count, timing * 1000))
+
+
+if __name__ == '__main__':
+    main()
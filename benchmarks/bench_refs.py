@@ -0,0 +1,147 @@
+import argparse
+import time
+
+import sqlalchemy as sa
+import sqlalchemy.ext.declarative
+from fast_alchemy import FastAlchemy
+
+MODELS = {
+    'AntCollection': {
+        'definition': {
+            'name': 'String',
+            'location': 'String',
+            'formicaria': 'Backref|Formicarium',
+        }
+    },
+    'Formicarium': {
+        'definition': {
+            'name': 'String',
+            'formicarium_type': 'String',
+            'collection': 'relationship|AntCollection',
+            'colonies': 'Backref|AntColony',
+            'polymorphic': {
+                'on': 'formicarium_type'
+            },
+        }
+    },
+    'SandwichFormicarium|Formicarium': {
+        'definition': {
+            'height': 'Integer'
+        }
+    },
+    'FreeStandingFormicarium|Formicarium': {
+        'definition': {
+            'depth': 'Integer'
+        }
+    },
+    'AntColony': {
+        'definition': {
+            'name': 'String',
+            'size': 'Integer',
+            'formicarium': 'relationship|Formicarium',
+        }
+    },
+}
+
+
+def build_instances(instance_count):
+    formicarium_count = max(instance_count // 100, 1)
+    raw = {
+        'AntCollection': {
+            'ref': 'name,location',
+            'instances': [{
+                'name': 'Collection',
+                'location': 'Bedroom'
+            }]
+        },
+        'SandwichFormicarium': {
+            'ref': 'name',
+            'instances': [{
+                'name': 'Sandwich {}'.format(i),
+                'collection': 'Collection, Bedroom',
+            } for i in range(formicarium_count)]
+        },
+        'FreeStandingFormicarium': {
+            'ref': 'name',
+            'instances': [{
+                'name': 'Free {}'.format(i),
+                'collection': 'Collection, Bedroom',
+            } for i in range(formicarium_count)]
+        },
+        'AntColony': {
+            'ref': 'name',
+            'instances': [{
+                'name': 'Colony {}'.format(i),
+                'size': i,
+                'formicarium': 'Free {}'.format(i % formicarium_count),
+            } for i in range(instance_count)]
+        },
+    }
+    return raw
+
+
+def build_fast_alchemy():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    fa = FastAlchemy(Base, sa.orm.scoped_session(Session))
+    fa.load_models(MODELS)
+    return fa
+
+
+def time_refs(instance_count, repeat):
+    fa = build_fast_alchemy()
+    timings = []
+    for _ in range(repeat):
+        raw = build_instances(instance_count)
+        loader = fa.options.instance_loader(fa, fa.class_registry, {
+            k: v['ref']
+            for (k, v) in raw.items()
+        }, fa.options.separator)
+        start = time.perf_counter()
+        # only the ref handling, no instances are built
+        for pending in loader.sort_instances(raw):
+            for relation, rel_klass_name in fa.get_model_info(
+                    fa.class_registry[pending.class_name]).many_to_one:
+                if relation in pending.definition:
+                    for candidate in loader.get_relation_candidates(
+                            rel_klass_name):
+                        loader.clean_ref(candidate,
+                                         pending.definition[relation])
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def time_load(instance_count, repeat):
+    fa = build_fast_alchemy()
+    timings = []
+    for _ in range(repeat):
+        raw = build_instances(instance_count)
+        start = time.perf_counter()
+        fa.load_instances(raw)
+        timings.append(time.perf_counter() - start)
+        fa.session.rollback()
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time resolving refs and relations of loaded instances')
+    parser.add_argument(
+        '--instance-counts', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:>10} {:>12} {:>12}'.format('instances', 'refs (ms)',
+                                        'load (ms)'))
+    for instance_count in args.instance_counts:
+        refs = time_refs(instance_count, args.repeat)
+        load = time_load(instance_count, args.repeat)
+        print('{:>10} {:>12.1f} {:>12.1f}'.format(instance_count,
+                                                  refs * 1000, load * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import yaml
+
+
+def model_names(model_count, inheritance_depth):
+    # every root model gets a chain of subclasses, deepest last
+    for i in range(model_count):
+        root = 'Model{}'.format(i)
+        yield root, None
+        parent = root
+        for depth in range(1, inheritance_depth + 1):
+            name = '{}Sub{}'.format(root, depth)
+            yield name, parent
+            parent = name
+
+
+def build_ref(name, index, composite_refs):
+    value = '{} {}'.format(name, index)
+    if composite_refs:
+        return '{}, group {}'.format(value, index % 10)
+    return value
+
+
+def build_instance(name, index, composite_refs):
+    instance = {'name': '{} {}'.format(name, index), 'size': index}
+    if composite_refs:
+        instance['group'] = 'group {}'.format(index % 10)
+    return instance
+
+
+def build_models(model_count=10, inheritance_depth=0, composite_refs=False):
+    ref = 'name,group' if composite_refs else 'name'
+    models = {}
+    for name, parent in model_names(model_count, inheritance_depth):
+        if parent:
+            models['{}|{}'.format(name, parent)] = {
+                'ref': ref,
+                'definition': {
+                    '{}_size'.format(name.lower()): 'Integer'
+                },
+            }
+            continue
+
+        index = int(name[len('Model'):])
+        definition = {'name': 'String', 'size': 'Integer'}
+        if composite_refs:
+            definition['group'] = 'String'
+        if index + 1 < model_count:
+            definition['children'] = 'Backref|Model{}'.format(index + 1)
+        if index > 0:
+            definition['parent'] = 'relationship|Model{}'.format(index - 1)
+        if inheritance_depth:
+            definition['model_type'] = 'String'
+            definition['polymorphic'] = {'on': 'model_type'}
+        models[name] = {'ref': ref, 'definition': definition}
+    return models
+
+
+def build_instances(model_count=10,
+                    inheritance_depth=0,
+                    instances_per_model=100,
+                    fan_out=5,
+                    composite_refs=False,
+                    start=0,
+                    stop=None):
+    # every model points to the roots of the previous one, each of those
+    # referenced by fan_out instances
+    stop = instances_per_model if stop is None else stop
+    raw = {}
+    for name, parent in model_names(model_count, inheritance_depth):
+        root = name.split('Sub')[0]
+        index = int(root[len('Model'):])
+        instances = []
+        for i in range(start, stop):
+            instance = build_instance(name, i, composite_refs)
+            if index > 0:
+                parent_index = (i // fan_out) % instances_per_model
+                instance['parent'] = build_ref(
+                    'Model{}'.format(index - 1), parent_index, composite_refs)
+            instances.append(instance)
+        raw[name] = {
+            'ref': 'name,group' if composite_refs else 'name',
+            'instances': instances
+        }
+    return raw
+
+
+def build_fixture(model_count=10,
+                  inheritance_depth=0,
+                  instances_per_model=100,
+                  fan_out=5,
+                  composite_refs=False,
+                  start=0,
+                  stop=None):
+    fixture = build_models(model_count, inheritance_depth, composite_refs)
+    instances = build_instances(model_count, inheritance_depth,
+                                instances_per_model, fan_out, composite_refs,
+                                start, stop)
+    for key, fields in fixture.items():
+        fields['instances'] = instances[key.split('|')[0]]['instances']
+    return fixture
+
+
+def write_fixture(path, fixture):
+    with open(path, 'w') as fh:
+        yaml.safe_dump(fixture, fh, default_flow_style=False, sort_keys=False)
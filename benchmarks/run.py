@@ -0,0 +1,206 @@
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+import sqlalchemy.ext.declarative
+from fast_alchemy import FastAlchemy
+from fast_alchemy.export import FastAlchemyExporter
+from fixtures import build_fixture, build_instances, build_models, write_fixture
+
+
+def build_fast_alchemy():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    return FastAlchemy(Base, sa.orm.scoped_session(Session))
+
+
+class Fixtures:
+    def __init__(self, params, directory):
+        self.params = params
+        self.directory = directory
+        schema = dict(
+            model_count=params['models'],
+            inheritance_depth=params['depth'],
+            composite_refs=params['composite_refs'])
+        instances = dict(
+            schema,
+            instances_per_model=params['instances'],
+            fan_out=params['fan_out'])
+        existing = int(params['instances'] * params['preexisting'])
+
+        self.full = self.write('full.yaml', build_fixture(**instances))
+        self.existing = self.write('existing.yaml',
+                                   build_fixture(stop=existing, **instances))
+        self.instances = self.write('instances.yaml',
+                                    build_instances(**instances))
+        self.models = self.write('models.yaml', build_models(**schema))
+        # new instances relating to rows that are only in the database
+        self.missing = self.write(
+            'missing.yaml',
+            build_instances(
+                start=params['instances'],
+                stop=2 * params['instances'],
+                **instances))
+
+    def write(self, name, fixture):
+        path = os.path.join(self.directory, name)
+        write_fixture(path, fixture)
+        return path
+
+
+def load_instances(fa, path, auto_load=False):
+    instances = fa.load_instances(path, auto_load=auto_load)
+    fa.session.add_all(instances.values())
+    fa.session.commit()
+
+
+# every case prepares the database and returns what is timed
+def load(fa, fixtures):
+    return lambda: fa.load(fixtures.full)
+
+
+def load_existing(fa, fixtures):
+    fa.load(fixtures.existing)
+    return lambda: load_instances(fa, fixtures.instances)
+
+
+def auto_load(fa, fixtures):
+    fa.load(fixtures.full)
+    return lambda: load_instances(fa, fixtures.missing, auto_load=True)
+
+
+def drop_models(fa, fixtures):
+    fa.load(fixtures.full)
+    return fa.drop_models
+
+
+def export(fa, fixtures):
+    return lambda: fa.export_to_python(fixtures.models, io.StringIO())
+
+
+CASES = OrderedDict([
+    ('load', load),
+    ('load_existing', load_existing),
+    ('auto_load', auto_load),
+    ('drop_models', drop_models),
+    ('export', export),
+])
+
+
+def run_case(case, fixtures):
+    fa = FastAlchemyExporter() if case == 'export' else build_fast_alchemy()
+    run = CASES[case](fa, fixtures)
+    fa.stats.reset()
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start, fa.stats.as_dict()
+
+
+def run_benchmarks(params, cases, repeat):
+    directory = tempfile.mkdtemp()
+    try:
+        fixtures = Fixtures(params, directory)
+        results = {}
+        for case in cases:
+            timings = []
+            for _ in range(repeat):
+                timing, stats = run_case(case, fixtures)
+                timings.append(timing)
+            results[case] = {
+                'min': min(timings),
+                'median': statistics.median(timings),
+                'timings': timings,
+                'stats': stats,
+            }
+    finally:
+        shutil.rmtree(directory)
+    return {
+        'params': params,
+        'python': platform.python_version(),
+        'sqlalchemy': sa.__version__,
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print('{:<16} {:>12} {:>12} {:>8}'.format('case', 'baseline (s)',
+                                              'current (s)', 'ratio'))
+    for case, result in results['results'].items():
+        if case not in baseline['results']:
+            continue
+        old = baseline['results'][case]['min']
+        ratio = result['min'] / old if old else float('inf')
+        flag = ' !' if ratio > threshold else ''
+        print('{:<16} {:>12.4f} {:>12.4f} {:>8.2f}{}'.format(
+            case, old, result['min'], ratio, flag))
+        if ratio > threshold:
+            regressions.append(case)
+    if baseline['params'] != results['params']:
+        print('warning: the baseline ran with {}'.format(baseline['params']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time fast-alchemy against a synthetic schema')
+    parser.add_argument('--models', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=1,
+                        help='inheritance depth below every model')
+    parser.add_argument('--instances', type=int, default=200,
+                        help='instances per model')
+    parser.add_argument('--fan-out', type=int, default=5,
+                        help='instances relating to the same parent')
+    parser.add_argument('--composite-refs', action='store_true')
+    parser.add_argument('--preexisting', type=float, default=0.5,
+                        help='share of the instances already in the database')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results as json')
+    parser.add_argument('--compare', help='json results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio that counts as a regression')
+    args = parser.parse_args()
+
+    params = {
+        'models': args.models,
+        'depth': args.depth,
+        'instances': args.instances,
+        'fan_out': args.fan_out,
+        'composite_refs': args.composite_refs,
+        'preexisting': args.preexisting,
+    }
+    results = run_benchmarks(params, args.cases, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('regressions: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+        return
+
+    print('{:<16} {:>10} {:>10}'.format('case', 'min (s)', 'median (s)'))
+    for case, result in results['results'].items():
+        print('{:<16} {:>10.4f} {:>10.4f}'.format(case, result['min'],
+                                                  result['median']))
+
+
+if __name__ == '__main__':
+    main()
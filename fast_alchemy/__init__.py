@@ -1,18 +1,47 @@
+import decimal
+import hashlib
 import json
-from collections import defaultdict, namedtuple
+from collections import ChainMap, OrderedDict, defaultdict, deque, namedtuple
+from itertools import chain, groupby
 
 import sqlalchemy as sa
-from sqlalchemy import String, and_, or_, orm
+from sqlalchemy import String, orm
 from sqlalchemy.inspection import inspect as sqla_inspect
 from sqlalchemy.sql.expression import cast
 
-from .helpers import drop_models, load_file, scan_current_models
+from .bulk import BulkInserter, get_pk_column
+from .coerce import (coerce_instances, coerce_value, format_errors,
+                     get_converters)
+from .generate import generate_instances
+from .helpers import (SECONDARY, chunked_filters, drop_models,
+                      get_secondary_tables, iter_batches, load_file,
+                      register_model, scan_current_models, stream_file,
+                      unregister_model)
+from .parallel import ParallelInserter
+from .snapshot import take_snapshot
+from .sources import read_source, resolve_source
+from .stats import LoadStats
 
 ClassInfo = namedtuple('ClassInfo', 'class_name,inherits_class,inherits_name')
 FieldInfo = namedtuple('FieldInfo', 'field_name,field_definition,field_args')
+ModelInfo = namedtuple(
+    'ModelInfo',
+    'columns,relations,many_to_one,many_to_many,relation_names,ref,ref_keys,'
+    'converters')
+CachedModel = namedtuple('CachedModel', 'key,klass')
+LazyModel = namedtuple('LazyModel', 'class_definition,fields,create')
+PendingInstance = namedtuple('PendingInstance',
+                             'class_name,ref_name,ref,definition')
+RefIndex = namedtuple('RefIndex', 'kind,columns')
 NO_COLUMN_FOR = ['relationship']
+RELATED_FIELDS = ['relationship', 'Backref', 'ManyToMany']
+MANY_TO_MANY = 'ManyToMany'
 FIELD_LOCATIONS = [sa, orm]
 OPTIONS = None
+DROP = 'drop'
+SAVEPOINT = 'savepoint'
+INDEX = 'index'
+UNIQUE = 'unique'
 
 
 class Options:
@@ -21,7 +50,23 @@ class Options:
         self.class_builder = kwargs.pop('class_builder', ClassBuilder)
         self.field_builder = kwargs.pop('field_builder', FieldBuilder)
         self.file_loader = kwargs.pop('file_loader', load_file)
+        self.file_streamer = kwargs.pop('file_streamer', stream_file)
         self.separator = kwargs.pop('separator', ',')
+        self.bulk_inserter = kwargs.pop('bulk_inserter', BulkInserter)
+        self.parallel_inserter = kwargs.pop('parallel_inserter',
+                                            ParallelInserter)
+        self.batch_size = kwargs.pop('batch_size', 1000)
+        self.workers = kwargs.pop('workers', 4)
+        self.chunk_size = kwargs.pop('chunk_size', 500)
+        self.context_mode = kwargs.pop('context_mode', DROP)
+        self.memoize_models = kwargs.pop('memoize_models', False)
+        self.on_phase_start = kwargs.pop('on_phase_start', None)
+        self.on_phase_end = kwargs.pop('on_phase_end', None)
+        self.index_refs = kwargs.pop('index_refs', None)
+        self.coerce_types = kwargs.pop('coerce_types', True)
+        if self.index_refs not in (None, INDEX, UNIQUE):
+            msg = 'index_refs should be one of {}, {} or None, not {}'
+            raise Exception(msg.format(INDEX, UNIQUE, self.index_refs))
 
 
 class FieldBuilder:
@@ -29,6 +74,9 @@ class FieldBuilder:
         fields = {}
         kwargs = {}
 
+        if field_info.field_definition == MANY_TO_MANY:
+            return self._build_many_to_many(field_info, class_name, backrefs)
+
         if field_info.field_definition == 'relationship':
             fk_name, fk = self._build_relation(field_info)
             fields[fk_name] = fk
@@ -53,6 +101,120 @@ class FieldBuilder:
         fk = sa.Column(fk_name, sa.Integer, sa.ForeignKey(fk_relation))
         return fk_name, fk
 
+    def _build_many_to_many(self, field_info, class_name, backrefs):
+        target = field_info.field_args[0]
+        secondary = get_secondary_name(class_name, field_info.field_name)
+        relation = orm.relationship(
+            target,
+            secondary=secondary,
+            backref=backrefs[class_name].get(target),
+            **get_secondary_joins(class_name, target, secondary))
+        return {field_info.field_name: relation}
+
+
+def get_secondary_name(class_name, field_name):
+    return '{}_{}'.format(class_name.lower(), field_name)
+
+
+def get_secondary_columns(tablename, target_tablename):
+    # a model relating to itself needs distinct column names
+    if tablename == target_tablename:
+        return ('{}_id'.format(tablename), 'related_{}_id'.format(tablename))
+    return ('{}_id'.format(tablename), '{}_id'.format(target_tablename))
+
+
+def get_secondary_joins(class_name, target, secondary):
+    # both columns of a model relating to itself point at the same table,
+    # so sqlalchemy has to be told which side is which
+    if class_name != target:
+        return {}
+    tablename = class_name.lower()
+    columns = get_secondary_columns(tablename, tablename)
+    join = '{}.id == {}.c.{}'
+    return OrderedDict([
+        ('primaryjoin', join.format(class_name, secondary, columns[0])),
+        ('secondaryjoin', join.format(class_name, secondary, columns[1])),
+    ])
+
+
+def parse_field(field_name, field_definition):
+    # compiled files already hold parsed fields
+    if isinstance(field_definition, FieldInfo):
+        return field_definition
+    field_args = []
+    if '|' in field_definition:
+        field_definition, args = field_definition.split('|')
+        field_args = args.split(',')
+    return FieldInfo(field_name, field_definition, field_args)
+
+
+def get_ref_index(fields, ref, kind, sep):
+    if not kind or not ref:
+        return None
+    columns = []
+    for key in get_ref_keys(ref, sep):
+        # refs on inherited columns are indexed by the parent model
+        if key not in fields:
+            return None
+        field_info = parse_field(key, fields[key])
+        if field_info.field_definition == 'relationship':
+            key = '{}_id'.format(key)
+        elif field_info.field_definition == 'Backref':
+            return None
+        columns.append(key)
+    return RefIndex(kind, tuple(columns))
+
+
+def get_model_key(class_info, fields, ref_index=None):
+    definition = []
+    for field_name, field_definition in fields.items():
+        if field_name == 'polymorphic':
+            definition.append([field_name, sorted(field_definition.items())])
+            continue
+        field_info = parse_field(field_name, field_definition)
+        definition.append([
+            field_name, field_info.field_definition,
+            list(field_info.field_args)
+        ])
+    key = [
+        class_info.class_name, class_info.inherits_name, definition, ref_index
+    ]
+    raw = json.dumps(key, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_required_models(class_definition, fields):
+    # a model can't be mapped without its parent, the models it relates to
+    # and the models that hold a backref to it
+    _, _, inherits_name = class_definition.partition('|')
+    required = [inherits_name] if inherits_name else []
+    for field_name, field_definition in fields['definition'].items():
+        if field_name == 'polymorphic':
+            continue
+        field_info = parse_field(field_name, field_definition)
+        if field_info.field_definition in RELATED_FIELDS:
+            required.append(field_info.field_args[0])
+    return required
+
+
+def get_instance_key(definition):
+    raw = json.dumps(definition, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_related_refs(definition, relation):
+    refs = definition.get(relation) or []
+    if isinstance(refs, str):
+        return [refs]
+    return refs
+
+
+def format_ref_value(value):
+    # a numeric column hands back 2.5 as 2.5000000000
+    if isinstance(value, decimal.Decimal):
+        return '{:f}'.format(value.normalize())
+    return str(value).strip()
+
 
 def get_ref_from_instance(instance, ref, sep):
     keys = ref.split(sep)
@@ -73,10 +235,10 @@ def scan_attributes(klass):
     return attributes
 
 
-def scan_relations(klass):
+def scan_relations(klass, direction='MANYTOONE'):
     relations = []
     for rel in sqla_inspect(klass).relationships:
-        if rel.direction.name == 'MANYTOONE':
+        if rel.direction.name == direction:
             relations.append((rel.key, rel.mapper.class_.__name__))
     return relations
 
@@ -88,6 +250,25 @@ def scan_all_relations(klass):
     return relations
 
 
+def describe_model(klass, ref=None, sep=','):
+    relations = scan_all_relations(klass)
+    return ModelInfo(
+        columns=tuple(scan_attributes(klass)),
+        relations=tuple(relations),
+        many_to_one=tuple(scan_relations(klass)),
+        many_to_many=tuple(scan_relations(klass, 'MANYTOMANY')),
+        relation_names=frozenset(r for (r, k) in relations),
+        ref=ref,
+        ref_keys=get_ref_keys(ref, sep),
+        converters=get_converters(klass))
+
+
+def get_ref_keys(ref, sep):
+    if not ref:
+        return ()
+    return tuple(key.strip() for key in ref.split(sep))
+
+
 def instance_to_ref(instances, instance, ref, sep, base_model):
     physical_ref = []
     keys = ref.split(sep)
@@ -97,7 +278,7 @@ def instance_to_ref(instances, instance, ref, sep, base_model):
             klass_name = attr.__class__.__name__
             ref = instances[klass_name]['ref']
             attr = instance_to_ref(instances, attr, ref, sep, base_model)
-        physical_ref.append(str(attr))
+        physical_ref.append(format_ref_value(attr))
     return sep.join(physical_ref)
 
 
@@ -108,11 +289,7 @@ class ClassBuilder:
         self.field_builder = field_builder.build_field
 
     def _parse_field(self, field_name, field_definition):
-        field_args = []
-        if '|' in field_definition:
-            field_definition, args = field_definition.split('|')
-            field_args = args.split(',')
-        return FieldInfo(field_name, field_definition, field_args)
+        return parse_field(field_name, field_definition)
 
     def _parse_fields(self, fields, class_name):
         for field_name, field_definition in fields.items():
@@ -136,14 +313,51 @@ class ClassBuilder:
             pk_args.append(sa.ForeignKey(fk_id))
         return sa.Column(*pk_args, primary_key=True)
 
-    def build_class(self, class_info, fields):
+    def _build_ref_index(self, tablename, ref_index):
+        if ref_index.kind == UNIQUE:
+            name = 'uq_{}_ref'.format(tablename)
+            return sa.UniqueConstraint(*ref_index.columns, name=name)
+        return sa.Index('ix_{}_ref'.format(tablename), *ref_index.columns)
+
+    def _build_secondary(self, tablename, field_info):
+        target_tablename = field_info.field_args[0].lower()
+        columns = get_secondary_columns(tablename, target_tablename)
+        targets = (tablename, target_tablename)
+        return sa.Table(
+            get_secondary_name(tablename, field_info.field_name),
+            self.db.Model.metadata,
+            *[
+                sa.Column(
+                    column,
+                    sa.Integer,
+                    sa.ForeignKey('{}.id'.format(target)),
+                    primary_key=True)
+                for (column, target) in zip(columns, targets)
+            ],
+            info={SECONDARY: True})
+
+    def build_class(self, class_info, fields, ref=None):
         class_name = class_info.class_name
         tablename = class_name.lower()
 
+        options = self.db.options
+        ref_index = get_ref_index(fields, ref, options.index_refs,
+                                  options.separator)
+        key = get_model_key(class_info, fields, ref_index)
+        Klass = self.db.get_cached_model(class_name, key)
+        if Klass is not None:
+            # the backrefs are still needed by the models built after it
+            for _ in self._parse_fields(fields, class_name):
+                pass
+            return Klass
+
         class_attributes = {
             '__tablename__': tablename,
             'id': self._build_pk(class_info)
         }
+        if ref_index:
+            class_attributes['__table_args__'] = (self._build_ref_index(
+                tablename, ref_index), )
         if class_info.inherits_name or 'polymorphic' in fields:
             polymorphic_def = fields.pop('polymorphic', {})
             polymorphic_def['identity'] = class_info.class_name.lower()
@@ -151,11 +365,14 @@ class ClassBuilder:
             class_attributes['__mapper_args__'] = definition
 
         for field_info in self._parse_fields(fields, class_name):
+            if field_info.field_definition == MANY_TO_MANY:
+                self._build_secondary(tablename, field_info)
             class_attributes.update(
                 self.field_builder(field_info, class_name, self.backrefs))
 
         Klass = type(class_name, class_info.inherits_class, class_attributes)
         setattr(self.db, class_name, Klass)
+        self.db.cache_model(class_name, key)
         return Klass
 
 
@@ -166,6 +383,27 @@ class InstanceLoader:
         self.auto_load = auto_load
         self.ref_mapping = ref_mapping
         self.sep = separator
+        self.missing_refs = defaultdict(OrderedDict)
+        self.associations = defaultdict(list)
+        self.pending_associations = []
+        self._ref_builders = {}
+        self._candidates = {}
+        self._clean_refs = {}
+
+    def expand_instances(self, fields, instances=None):
+        if instances is None:
+            instances = fields.get('instances') or []
+        if isinstance(instances, str):
+            instances = read_source(instances, self.db.options.batch_size)
+        if 'generate' not in fields:
+            return instances
+        # generated instances are only built while they're consumed
+        return chain(instances, generate_instances(fields['generate']))
+
+    def add_ref_mapping(self, klass_name, ref_name):
+        self.ref_mapping[klass_name] = ref_name
+        # a new ref makes a subclass a candidate for relations
+        self._candidates.clear()
 
     def load_instance(self, class_info, ref_name, instances, instance_refs):
         klass_name = class_info.class_name
@@ -181,24 +419,135 @@ class InstanceLoader:
 
     def link_relations(self, class_info, ref_name, instances, instance_refs):
         klass_name = class_info.class_name
-        klass = self.classes[klass_name]
+        info = self.db.get_model_info(self.classes[klass_name])
         for definition in instances:
             ref = self.build_ref(klass_name, definition, ref_name)
             instance = instance_refs[ref]
-            for relation, rel_klass_name in scan_relations(klass):
+            for relation, rel_klass_name in info.many_to_one:
+                if relation in definition:
+                    self.build_relation(instance, rel_klass_name, definition,
+                                        instance_refs, relation)
+            for relation, rel_klass_name in info.many_to_many:
+                if relation in definition:
+                    self.build_association(instance, rel_klass_name,
+                                           definition, instance_refs, relation)
+
+    def sort_instances(self, raw_instances):
+        # instances are ordered by the models they depend on, only models
+        # depending on each other are ordered instance by instance
+        models = OrderedDict()
+        for klass_name, fields in raw_instances.items():
+            if not fields.get('instances'):
+                continue
+            models[klass_name] = [
+                PendingInstance(klass_name, fields['ref'],
+                                self.build_ref(klass_name, d, fields['ref']),
+                                d) for d in fields['instances']
+            ]
+        dependencies = OrderedDict(
+            (k, self.get_model_dependencies(k, v, models))
+            for (k, v) in models.items())
+
+        pending = []
+        while dependencies:
+            ready = [
+                k for (k, deps) in dependencies.items()
+                if not any(d in dependencies for d in deps)
+            ]
+            if not ready:
+                remaining = [p for k in dependencies for p in models[k]]
+                pending.extend(self._sort_by_ref(remaining))
+                break
+            for klass_name in ready:
+                pending.extend(models[klass_name])
+                dependencies.pop(klass_name)
+        return pending
+
+    def get_model_dependencies(self, klass_name, pending, models):
+        relations = self.db.get_model_info(self.classes[klass_name]).many_to_one
+        dependencies = set()
+        for relation, rel_klass_name in relations:
+            if not any(relation in p.definition for p in pending):
+                continue
+            for candidate in self.get_relation_candidates(rel_klass_name):
+                if candidate in models:
+                    dependencies.add(candidate)
+        return dependencies
+
+    def _sort_by_ref(self, pending):
+        refs = set(p.ref for p in pending)
+        waiting = defaultdict(list)
+        missing = []
+        for idx, instance in enumerate(pending):
+            dependencies = self.get_instance_dependencies(instance, refs)
+            missing.append(len(dependencies))
+            for ref in dependencies:
+                waiting[ref].append(idx)
+
+        ordered = []
+        queue = deque(idx for (idx, count) in enumerate(missing) if not count)
+        while queue:
+            instance = pending[queue.popleft()]
+            ordered.append(instance)
+            for idx in waiting.pop(instance.ref, []):
+                missing[idx] -= 1
+                if not missing[idx]:
+                    queue.append(idx)
+
+        if len(ordered) < len(pending):
+            cycle = [p.ref for (p, count) in zip(pending, missing) if count]
+            raise Exception('Circular references between {}'.format(
+                ', '.join(cycle)))
+        return ordered
+
+    def get_instance_dependencies(self, instance, refs):
+        klass = self.classes[instance.class_name]
+        dependencies = set()
+        for relation, rel_klass_name in self.db.get_model_info(
+                klass).many_to_one:
+            if relation not in instance.definition:
+                continue
+            related_ref = instance.definition[relation]
+            for candidate in self.get_relation_candidates(rel_klass_name):
+                ref = self.clean_ref(candidate, related_ref)
+                if ref in refs:
+                    dependencies.add(ref)
+        return dependencies
+
+    def load_sorted(self, pending, instance_refs):
+        # every instance is built and linked in one go, the instances it
+        # relates to are already built by then
+        for instance_info in pending:
+            klass = self.classes[instance_info.class_name]
+            instance = instance_refs.get(instance_info.ref)
+            if instance is None:
+                instance = self.build_instance(klass, instance_info.definition,
+                                               instance_refs,
+                                               instance_info.ref_name)
+                instance_refs[instance_info.ref] = instance
+            definition = instance_info.definition
+            info = self.db.get_model_info(klass)
+            for relation, rel_klass_name in info.many_to_one:
                 if relation in definition:
                     self.build_relation(instance, rel_klass_name, definition,
                                         instance_refs, relation)
+            for relation, rel_klass_name in info.many_to_many:
+                if relation in definition:
+                    self.build_association(instance, rel_klass_name,
+                                           definition, instance_refs, relation)
 
     def get_relation_candidates(self, parent_class):
-        candidates = [parent_class]
-        for subclass in self.classes[parent_class].__subclasses__():
-            if subclass.__name__ in self.ref_mapping:
-                candidates.append(subclass.__name__)
+        candidates = self._candidates.get(parent_class)
+        if candidates is None:
+            candidates = [parent_class]
+            for subclass in self.classes[parent_class].__subclasses__():
+                if subclass.__name__ in self.ref_mapping:
+                    candidates.append(subclass.__name__)
+            self._candidates[parent_class] = candidates
         return candidates
 
     def build_instance(self, klass, definition, instance_refs, ref_name):
-        rels = [r for (r, k) in scan_all_relations(klass)]
+        rels = self.db.get_model_info(klass).relation_names
         attributes = {k: v for (k, v) in definition.items() if k not in rels}
         try:
             return klass(**attributes)
@@ -208,25 +557,47 @@ class InstanceLoader:
 
     def build_relation(self, instance, klass_name, definition, instance_refs,
                        relation):
-        ref_name = definition[relation]
-
+        related_instance = self.get_related_instance(
+            klass_name, definition[relation], instance_refs)
+        if isinstance(related_instance, tuple):
+            self.set_foreign_key(instance, relation, related_instance)
+        else:
+            setattr(instance, relation, related_instance)
+
+    def build_association(self, instance, klass_name, definition,
+                          instance_refs, relation):
+        # associations are inserted in bulk once both sides have their
+        # primary key, instead of being appended to the collection
+        rel = sqla_inspect(instance).mapper.relationships[relation]
+        self.pending_associations.append(
+            (rel, instance, klass_name, get_related_refs(definition, relation),
+             instance_refs))
+
+    def resolve_associations(self):
+        # models only depend on their many to one relations, so the related
+        # instances are looked up once every instance is built
+        for rel, instance, klass_name, ref_names, instance_refs in (
+                self.pending_associations):
+            for ref_name in ref_names:
+                related_instance = self.get_related_instance(
+                    klass_name, ref_name, instance_refs)
+                self.associations[rel].append((instance, related_instance))
+        self.pending_associations = []
+
+    def get_related_instance(self, klass_name, ref_name, instance_refs):
         def get_instance(candidates):
             instances = []
             for candidate in candidates:
                 clean_ref = self.clean_ref(candidate, ref_name)
                 related_instance = instance_refs.get(clean_ref)
-                if related_instance:
+                if related_instance and related_instance not in instances:
                     instances.append(related_instance)
             return instances
 
         instances = get_instance([klass_name])
         if not instances:
-            instances = get_instance(self.get_relation_candidates(klass_name))
-
-        if not instances and self.auto_load:
-            instances = self._load_from_db(
-                self.get_relation_candidates(klass_name), ref_name,
-                instance_refs)
+            candidates = self.get_relation_candidates(klass_name)
+            instances = get_instance(candidates[1:])
 
         if not instances:
             msg = "Searched types: {}".format(', '.join(
@@ -235,50 +606,183 @@ class InstanceLoader:
                 ref_name, msg))
         if len(instances) > 1:
             raise Exception('Too many results for {}'.format(ref_name))
-        related_instance = instances[0]
-        setattr(instance, relation, related_instance)
-
-    def _load_from_db(self, candidates, ref_name, instance_refs):
-        values = ref_name.split(self.sep)
-        instances = []
-        for candidate in candidates:
-            keys = self.ref_mapping[candidate].split(self.sep)
-            fltr = dict(zip(keys, values))
-            qry = self.db.session.query(self.classes[candidate])
-            instance = qry.filter_by(**fltr).one_or_none()
-            if instance:
-                instances.append(instance)
-                ref = self.clean_ref(candidate, ref_name)
-                instance_refs[ref] = instance
-        return instances
+        return instances[0]
+
+    def set_foreign_key(self, instance, relation, identity):
+        mapper = sqla_inspect(instance).mapper
+        rel = mapper.relationships[relation]
+        pk_values = dict(zip(rel.mapper.primary_key, identity))
+        for local, remote in rel.local_remote_pairs:
+            key = mapper.get_property_by_column(local).key
+            setattr(instance, key, pk_values[remote])
+
+    def collect_missing_relations(self, class_info, ref_name, instances,
+                                  instance_refs):
+        klass = self.classes[class_info.class_name]
+        info = self.db.get_model_info(klass)
+        for definition in instances:
+            for relation, rel_klass_name in info.many_to_one:
+                if relation in definition:
+                    self.collect_missing_relation(
+                        rel_klass_name, definition[relation], instance_refs)
+            for relation, rel_klass_name in info.many_to_many:
+                for related_ref in get_related_refs(definition, relation):
+                    self.collect_missing_relation(rel_klass_name, related_ref,
+                                                  instance_refs)
+
+    def collect_missing_relation(self, klass_name, related_ref,
+                                 instance_refs):
+        candidates = self.get_relation_candidates(klass_name)
+        refs = [self.clean_ref(c, related_ref) for c in candidates]
+        if not any(ref in instance_refs for ref in refs):
+            self.missing_refs[klass_name][related_ref] = None
+
+    def load_missing_relations(self, instance_refs):
+        for klass_name, ref_names in self.missing_refs.items():
+            for candidate in self.get_relation_candidates(klass_name):
+                self._load_from_db(candidate, list(ref_names), instance_refs)
+        self.missing_refs.clear()
+
+    def _load_from_db(self, candidate, ref_names, instance_refs):
+        klass = self.classes[candidate]
+        keys = self.db.get_model_info(klass,
+                                      self.ref_mapping[candidate]).ref_keys
+
+        # refs with less values than keys only filter on the first keys
+        lookups = defaultdict(dict)
+        for ref_name in ref_names:
+            values = tuple(v.strip() for v in ref_name.split(self.sep))
+            values = tuple(
+                self.db.coerce_value(klass, key, value)
+                for (key, value) in zip(keys, values))
+            lookups[len(values)][values] = ref_name
+
+        converters = self.db.get_model_info(klass).converters
+
+        def get_typed_value(key, value):
+            # rows are matched on typed values, 2.5 comes back as 2.50
+            if key in converters:
+                return coerce_value(converters, key, value)
+            return str(value)
+
+        qry = self.db.session.query(klass)
+        for length, refs in lookups.items():
+            found = {
+                tuple(get_typed_value(*p) for p in zip(keys, k)): v
+                for (k, v) in refs.items()
+            }
+            exprs = [getattr(klass, key) for key in keys[:length]]
+            for fltr in chunked_filters(exprs, list(refs),
+                                        self.db.options.chunk_size):
+                for instance in qry.filter(fltr):
+                    values = tuple(
+                        get_typed_value(key, getattr(instance, key))
+                        for key in keys[:length])
+                    ref = self.clean_ref(candidate, found[values])
+                    if ref in instance_refs:
+                        raise Exception(
+                            'Too many results for {}'.format(found[values]))
+                    instance_refs[ref] = instance
 
     def build_ref(self, klass_name, definition, ref_name):
-        names = []
-        for name in ref_name.split(self.sep):
-            name = name.strip()
-            ref_key = definition.get(name, 'None')
-            if self.sep not in ref_name:
-                ref_key = definition[name]
-            names.append(str(ref_key).strip())
-        instance_ref = self.sep.join(names)
-        return '{}|{}'.format(klass_name, instance_ref)
+        builder = self._ref_builders.get((klass_name, ref_name))
+        if builder is None:
+            builder = self.compile_ref(klass_name, ref_name)
+            self._ref_builders[(klass_name, ref_name)] = builder
+        return builder(definition)
+
+    def compile_ref(self, klass_name, ref_name):
+        info = self.db.get_model_info(self.classes[klass_name], ref_name)
+        prefix = '{}|'.format(klass_name)
+        sep = self.sep
+        if sep not in ref_name:
+            key = info.ref_keys[0]
+
+            def build_single_ref(definition):
+                return prefix + format_ref_value(definition[key])
+
+            return build_single_ref
+
+        keys = info.ref_keys
+
+        def build_ref(definition):
+            values = [
+                format_ref_value(definition.get(key, 'None')) for key in keys
+            ]
+            return prefix + sep.join(values)
+
+        return build_ref
 
     def clean_ref(self, klass_name, ref_name):
-        names = []
-        for name in ref_name.split(self.sep):
-            names.append(name.strip())
-        instance_ref = self.sep.join(names)
+        # the same instances tend to be referenced over and over
+        instance_ref = self._clean_refs.get((klass_name, ref_name))
+        if instance_ref is None:
+            names = [name.strip() for name in ref_name.split(self.sep)]
+            names = self.coerce_ref(klass_name, names)
+            instance_ref = self.sep.join(names)
+            self._clean_refs[(klass_name, ref_name)] = instance_ref
         return '{}|{}'.format(klass_name, instance_ref)
 
+    def coerce_ref(self, klass_name, names):
+        # the values of a ref are converted like those of the instances, so
+        # a float ref of 10 is found as 10.0
+        if klass_name not in self.ref_mapping:
+            return names
+        klass = self.classes[klass_name]
+        keys = self.db.get_model_info(klass,
+                                      self.ref_mapping[klass_name]).ref_keys
+        if len(keys) != len(names):
+            return names
+        return [
+            format_ref_value(self.db.coerce_value(klass, key, name))
+            for (key, name) in zip(keys, names)
+        ]
+
+
+class ModelRegistry(dict):
+    def __init__(self, build_model):
+        super().__init__()
+        self.build_model = build_model
+
+    def __missing__(self, class_name):
+        return self.build_model(class_name)
+
 
 class FastAlchemy:
     def __init__(self, base, session, **kwargs):
         self.Model = base
         self.session = session
-        self.class_registry = {}
+        self._lazy_models = OrderedDict()
+        self.class_registry = ModelRegistry(self._build_lazy_model)
         self._context_registry = {}
+        self._context_lazy_models = set()
+        self._model_info = {}
+        self._model_keys = {}
+        self._parked_models = {}
+        self._loaded_keys = {}
+        self._loaded_identities = {}
+        self._pending_associations = defaultdict(list)
+        self._savepoints = []
         self.in_context = False
         self.options = Options(**kwargs)
+        self.stats = LoadStats(self.options.on_phase_start,
+                               self.options.on_phase_end)
+
+    def __getattr__(self, name):
+        # lazy models are only built once they're asked for
+        if name in self.__dict__.get('_lazy_models', ()):
+            # hasattr should only ever see an AttributeError
+            try:
+                return self.class_registry[name]
+            except Exception as e:
+                raise AttributeError('{} could not be built: {!r}'.format(
+                    name, e)) from e
+        raise AttributeError("'{}' object has no attribute '{}'".format(
+            type(self).__name__, name))
+
+    def _phase(self, phase, model=None):
+        self.stats.watch(self.session.bind)
+        return self.stats.phase(phase, model)
 
     def _parse_class_definition(self, class_definition):
         inherits_class = (self.Model, )
@@ -289,43 +793,567 @@ class FastAlchemy:
             inherits_class = (self.class_registry[inherits_name], )
         return ClassInfo(class_name, inherits_class, inherits_name)
 
+    def get_model_info(self, klass, ref=None):
+        info = self._model_info.get(klass)
+        if info is None:
+            info = describe_model(klass, ref, self.options.separator)
+            self._model_info[klass] = info
+        elif ref is not None and ref != info.ref:
+            info = info._replace(
+                ref=ref, ref_keys=get_ref_keys(ref, self.options.separator))
+            self._model_info[klass] = info
+        return info
+
+    def get_cached_model(self, class_name, key):
+        if not self.options.memoize_models:
+            return None
+        cached = self._parked_models.get(class_name)
+        if cached is None:
+            return None
+        if cached.key != key:
+            self._unload_parked_models([cached.klass])
+            return None
+
+        self._parked_models.pop(class_name)
+        register_model(self.Model, cached.klass)
+        setattr(self, class_name, cached.klass)
+        self._model_keys[class_name] = key
+        return cached.klass
+
+    def cache_model(self, class_name, key):
+        if self.options.memoize_models:
+            self._model_keys[class_name] = key
+
+    def _unload_parked_models(self, classes):
+        names = self._related_parked_models(classes)
+        if not names:
+            return
+        for name in names:
+            register_model(self.Model, self._parked_models.pop(name).klass)
+        drop_models(
+            base_model=self.Model,
+            all_model_names=names,
+            model_names_to_drop=names)
+
+    def _related_parked_models(self, classes):
+        # parked models stay configured against the mappers they relate to
+        if not self._parked_models:
+            return []
+        parked = {v.klass: k for (k, v) in self._parked_models.items()}
+        related = []
+        todo = list(classes)
+        while todo:
+            mapper = sqla_inspect(todo.pop())
+            neighbours = [rel.mapper for rel in mapper.relationships]
+            neighbours.extend(mapper.iterate_to_root())
+            neighbours.extend(mapper.self_and_descendants)
+            for neighbour in neighbours:
+                name = parked.get(neighbour.class_)
+                if name is not None and name not in related:
+                    related.append(name)
+                    todo.append(neighbour.class_)
+        return related
+
+    def _invalidate_parked_models(self, raw_models):
+        # models related to a changed one can't be reused either, so they're
+        # all unloaded before anything gets built
+        changed = []
+        for class_definition, fields in raw_models:
+            # the parent class might not be registered yet
+            class_name, _, inherits_name = class_definition.partition('|')
+            class_info = ClassInfo(class_name, None, inherits_name or None)
+            cached = self._parked_models.get(class_name)
+            ref_index = get_ref_index(fields['definition'], fields.get('ref'),
+                                      self.options.index_refs,
+                                      self.options.separator)
+            key = get_model_key(class_info, fields['definition'], ref_index)
+            if cached is not None and cached.key != key:
+                changed.append(cached.klass)
+        self._unload_parked_models(changed)
+
     def _load_file(self, file_or_raw):
         raw = file_or_raw
         if isinstance(file_or_raw, str):
-            raw = self.options.file_loader(file_or_raw)
+            with self._phase('parse'):
+                raw = self.options.file_loader(file_or_raw)
+            for fields in raw.values():
+                if isinstance(fields.get('instances'), str):
+                    fields['instances'] = resolve_source(
+                        fields['instances'], file_or_raw)
         return raw
 
-    def load(self, filepath):
+    def coerce_value(self, klass, key, value):
+        if not self.options.coerce_types:
+            return value
+        return coerce_value(self.get_model_info(klass).converters, key, value)
+
+    def _coerce_instances(self, raw_instances):
+        if not self.options.coerce_types:
+            return
+        errors = []
+        for klass_name, fields in raw_instances.items():
+            if not fields.get('instances'):
+                continue
+            klass = self.class_registry[klass_name]
+            with self._phase('coerce', klass_name) as phase:
+                phase.rows += len(fields['instances'])
+                klass_errors = coerce_instances(
+                    self.get_model_info(klass).converters,
+                    fields['instances'])
+            if klass_errors:
+                errors.append((klass_name, klass_errors))
+        if errors:
+            raise Exception(format_errors(errors))
+
+    def _expand_raw_instances(self, loader, raw_instances):
+        # generated and external instances are needed up front
+        for klass_name, fields in list(raw_instances.items()):
+            if 'generate' in fields or isinstance(fields.get('instances'),
+                                                  str):
+                instances = list(loader.expand_instances(fields))
+                raw_instances[klass_name] = dict(fields, instances=instances)
+
+    def load(self, filepath, bulk=False, stream=False, parallel=False):
+        if stream and parallel:
+            raise Exception("Streaming can't be combined with parallel loads")
+        if stream:
+            self.load_stream(filepath, bulk=bulk)
+            return
         raw = self._load_file(filepath)
         self.load_models(raw)
+        if parallel:
+            # whatever the session holds goes in before the other connections
+            self.session.commit()
         instances = self.load_instances(raw)
-        self.session.add_all(instances.values())
-        self.session.commit()
+        with self._phase('insert') as phase:
+            phase.rows = len(instances)
+            if parallel:
+                self.parallel_insert(instances.values())
+            elif bulk:
+                self.bulk_insert(instances.values())
+            else:
+                self.session.add_all(instances.values())
+        self.insert_associations()
+        with self._phase('commit'):
+            self.session.commit()
+
+    def bulk_insert(self, instances):
+        inserter = self.options.bulk_inserter(self.session,
+                                              self.options.batch_size)
+        inserter.insert(instances)
+        self.insert_associations()
+
+    def parallel_insert(self, instances):
+        inserter = self.options.parallel_inserter(
+            self.session, self.options.batch_size, self.options.workers)
+        associations = self._pending_associations
+        self._pending_associations = defaultdict(list)
+        inserter.insert(instances, associations)
+
+    def insert_associations(self):
+        # many to many relations are inserted once both sides are flushed
+        if not self._pending_associations:
+            return
+        associations = self._pending_associations
+        self._pending_associations = defaultdict(list)
+        with self._phase('associate') as phase:
+            self.session.flush()
+            inserter = self.options.bulk_inserter(self.session,
+                                                  self.options.batch_size)
+            for rel, pairs in associations.items():
+                phase.rows += inserter.associate(rel, pairs)
+
+    def _collect_associations(self, loader):
+        loader.resolve_associations()
+        for rel, pairs in loader.associations.items():
+            self._pending_associations[rel].extend(pairs)
+        loader.associations.clear()
+
+    def load_stream(self,
+                    filepath,
+                    auto_load=False,
+                    bulk=False,
+                    ref_mapping=None):
+        self.class_registry.update(scan_current_models(self))
+        class_builder = self._get_class_builder()
+        if ref_mapping is None:
+            ref_mapping = {}
+        loader = self.options.instance_loader(
+            self,
+            self.class_registry,
+            ref_mapping,
+            self.options.separator,
+            auto_load,
+        )
 
-    def load_models(self, file_or_raw):
-        field_buider = self.options.field_builder()
-        class_builder = self.options.class_builder(self,
-                                                   field_buider).build_class
+        # only the primary keys of loaded instances are kept around
+        refs = {}
+        streamed = self.options.file_streamer(filepath)
+        for class_definition, fields, instances in streamed:
+            if 'definition' in fields:
+                self._build_models([(class_definition, fields)],
+                                   class_builder)
+            class_info = self._parse_class_definition(class_definition)
+            if 'ref' in fields:
+                loader.add_ref_mapping(class_info.class_name, fields['ref'])
+            if isinstance(instances, str):
+                instances = resolve_source(instances, filepath)
+            instances = loader.expand_instances(fields, instances)
+            batches = iter_batches(instances, self.options.batch_size)
+            while True:
+                # instances are only parsed while they're consumed
+                with self._phase('parse', class_info.class_name):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                self._load_batch(loader, class_info, batch, refs, bulk)
+        with self._phase('commit'):
+            self.session.commit()
+        return refs
+
+    def _load_batch(self, loader, class_info, batch, refs, bulk):
+        ref = loader.ref_mapping[class_info.class_name]
+        self._coerce_instances(
+            {class_info.class_name: {
+                'instances': batch
+            }})
+        batch = [
+            definition for definition in batch if loader.build_ref(
+                class_info.class_name, definition, ref) not in refs
+        ]
+        raw_instances = {k: {'ref': v} for k, v in loader.ref_mapping.items()}
+        raw_instances[class_info.class_name] = {'ref': ref, 'instances': batch}
+        instance_refs = ChainMap(
+            self._pre_load_existing_instances(raw_instances), refs)
+
+        klass_name = class_info.class_name
+        with self.session.no_autoflush:
+            with self._phase('build_instances', klass_name) as phase:
+                phase.rows += len(batch)
+                loader.load_instance(class_info, ref, batch, instance_refs)
+                self.stats.record_instance_refs(
+                    len(refs) + len(instance_refs.maps[0]))
+            if loader.auto_load:
+                with self._phase('auto_load', klass_name):
+                    loader.collect_missing_relations(class_info, ref, batch,
+                                                     instance_refs)
+                    loader.load_missing_relations(instance_refs)
+                    self.stats.record_instance_refs(
+                        len(refs) + len(instance_refs.maps[0]))
+            with self._phase('link_relations', klass_name):
+                loader.link_relations(class_info, ref, batch, instance_refs)
+
+        loaded = instance_refs.maps[0]
+        self._collect_associations(loader)
+        with self._phase('insert', klass_name) as phase:
+            phase.rows += len(loaded)
+            if bulk:
+                self.bulk_insert(loaded.values())
+            else:
+                self.session.add_all(loaded.values())
+                self.session.flush()
+                self.insert_associations()
+        for instance_ref, instance in loaded.items():
+            refs[instance_ref] = sqla_inspect(instance).identity
+            # an instance can be loaded under the ref of its parent as well
+            if instance in self.session:
+                self.session.expunge(instance)
+
+    def load_incremental(self,
+                         file_or_raw,
+                         delete=False,
+                         auto_load=False,
+                         ref_mapping=None):
+        raw = self._load_file(file_or_raw)
+        self._build_lazy_models(k.partition('|')[0] for k in raw)
+        self.class_registry.update(scan_current_models(self))
+        # models that are loaded already are kept as they are
+        raw_models = [(k, v) for (k, v) in raw.items() if 'definition' in v
+                      and k.partition('|')[0] not in self.class_registry]
+        self._build_models(raw_models, self._get_class_builder())
+
+        classes = scan_current_models(self)
+        self.class_registry.update(classes)
+        raw_instances = OrderedDict(
+            (self._parse_class_definition(k).class_name, v)
+            for (k, v) in raw.items())
+        if ref_mapping is None:
+            ref_mapping = {}
+        for klass_name, fields in raw_instances.items():
+            ref_mapping[klass_name] = fields['ref']
+        loader = self.options.instance_loader(
+            self,
+            classes,
+            ref_mapping,
+            self.options.separator,
+            auto_load,
+        )
+        self._expand_raw_instances(loader, raw_instances)
+        self._coerce_instances(raw_instances)
+
+        self._seed_loaded_instances(raw_instances)
+        with self._phase('diff') as phase:
+            added, changed, removed, keys = self._diff_instances(
+                loader, raw_instances, delete)
+            phase.rows += sum(len(refs) for refs in keys.values())
+
+        # relations to instances that are loaded already only need their
+        # primary key, removed instances can't be related to anymore
+        built = {}
+        found = {}
+        hidden = dict.fromkeys(ref for (_, ref) in removed)
+        known = [hidden, found] + list(self._loaded_identities.values())
+        if auto_load:
+            with self._phase('auto_load') as phase:
+                pending_raw = OrderedDict(
+                    (k, dict(raw_instances[k], instances=v))
+                    for (k, v) in chain(added.items(), changed.items()))
+                in_file = dict.fromkeys(chain.from_iterable(keys.values()))
+                self._initialisation(pending_raw, ChainMap(in_file, *known),
+                                     loader.collect_missing_relations)
+                loaded = {}
+                loader.load_missing_relations(ChainMap(loaded, *known))
+                for ref, instance in loaded.items():
+                    found[ref] = sqla_inspect(instance).identity
+                phase.rows += len(found)
+
+        inserter = self.options.bulk_inserter(self.session,
+                                              self.options.batch_size)
+        with self.session.no_autoflush:
+            with self._phase('sort_instances') as phase:
+                pending = loader.sort_instances(
+                    OrderedDict((k, dict(raw_instances[k], instances=v))
+                                for (k, v) in added.items()))
+                phase.rows += len(pending)
+            for klass_name, group in groupby(pending,
+                                             lambda p: p.class_name):
+                group = list(group)
+                with self._phase('build_instances', klass_name) as phase:
+                    phase.rows += len(group)
+                    loader.load_sorted(group, ChainMap(built, *known))
+            with self._phase('insert') as phase:
+                phase.rows += len(built)
+                inserter.insert(list(built.values()))
+            created = {
+                ref: sqla_inspect(instance).identity
+                for (ref, instance) in built.items()
+            }
+
+            updated = {}
+            pending = []
+            for klass_name, definitions in changed.items():
+                klass = self.class_registry[klass_name]
+                pending.extend(
+                    self._build_changed_instances(loader, klass, definitions,
+                                                  raw_instances, updated))
+            with self._phase('build_instances') as phase:
+                phase.rows += len(updated)
+                loader.load_sorted(pending,
+                                   ChainMap(updated, created, *known))
+            with self._phase('update') as phase:
+                phase.rows += len(updated)
+                inserter.update(updated.values())
+                # the many to many relations of a changed instance are
+                # replaced when they're part of its definition
+                for klass_name, definitions in changed.items():
+                    self._clear_associations(inserter, loader, klass_name,
+                                             definitions, raw_instances)
+            self._collect_associations(loader)
+            self.insert_associations()
+
+        with self._phase('delete') as phase:
+            phase.rows += len(removed)
+            inserter.delete([(self.class_registry[k],
+                              self._loaded_identities[k][ref])
+                             for (k, ref) in removed])
+        with self._phase('commit'):
+            self.session.commit()
+
+        for klass_name, refs in keys.items():
+            self._loaded_keys[klass_name].update(refs)
+            identities = self._loaded_identities[klass_name]
+            for ref in refs:
+                if ref in created:
+                    identities[ref] = created[ref]
+        for klass_name, ref in removed:
+            self._loaded_keys[klass_name].pop(ref)
+            self._loaded_identities[klass_name].pop(ref)
+
+    def _seed_loaded_instances(self, raw_instances):
+        # instances loaded before are looked up once, since it's unknown what
+        # they were loaded from they're all updated on the first reload
+        for klass_name, fields in raw_instances.items():
+            if fields.get('instances') is None:
+                continue
+            if klass_name in self._loaded_keys:
+                continue
+            class_info = self._parse_class_definition(klass_name)
+            with self._phase('pre_load', klass_name) as phase:
+                found = self._pre_load_instances(class_info, fields,
+                                                 raw_instances)
+                phase.rows += len(found)
+            self._loaded_keys[klass_name] = dict.fromkeys(found)
+            self._loaded_identities[klass_name] = {
+                ref: sqla_inspect(instance).identity
+                for (ref, instance) in found.items()
+            }
+
+    def _diff_instances(self, loader, raw_instances, delete):
+        added = OrderedDict()
+        changed = OrderedDict()
+        removed = []
+        keys = OrderedDict()
+        for klass_name, fields in raw_instances.items():
+            if fields.get('instances') is None:
+                continue
+            loaded_keys = self._loaded_keys[klass_name]
+            refs = OrderedDict()
+            for definition in fields['instances']:
+                ref = loader.build_ref(klass_name, definition, fields['ref'])
+                refs[ref] = key = get_instance_key(definition)
+                if ref not in loaded_keys:
+                    added.setdefault(klass_name, []).append(definition)
+                elif loaded_keys[ref] != key:
+                    changed.setdefault(klass_name, []).append(definition)
+            if delete:
+                removed.extend((klass_name, ref) for ref in loaded_keys
+                               if ref not in refs)
+            keys[klass_name] = OrderedDict(
+                (ref, key) for (ref, key) in refs.items()
+                if loaded_keys.get(ref) != key)
+        return added, changed, removed, keys
+
+    def _clear_associations(self, inserter, loader, klass_name, definitions,
+                            raw_instances):
+        klass = self.class_registry[klass_name]
+        ref_name = raw_instances[klass_name]['ref']
+        identities = self._loaded_identities[klass_name]
+        mapper = sqla_inspect(klass)
+        for relation, _ in self.get_model_info(klass).many_to_many:
+            instances = [
+                identities[loader.build_ref(klass_name, definition, ref_name)]
+                for definition in definitions if relation in definition
+            ]
+            if instances:
+                inserter.unassociate(mapper.relationships[relation],
+                                     instances)
+
+    def _build_changed_instances(self, loader, klass, definitions,
+                                 raw_instances, updated):
+        # changed instances are built with the primary key they were loaded
+        # with, so they can be updated without being queried
+        klass_name = klass.__name__
+        ref_name = raw_instances[klass_name]['ref']
+        mapper = sqla_inspect(klass)
+        pk_key = mapper.get_property_by_column(get_pk_column(mapper)).key
+        identities = self._loaded_identities[klass_name]
+        pending = []
+        for definition in definitions:
+            ref = loader.build_ref(klass_name, definition, ref_name)
+            instance = loader.build_instance(klass, definition, updated,
+                                             ref_name)
+            setattr(instance, pk_key, identities[ref][0])
+            updated[ref] = instance
+            pending.append(
+                PendingInstance(klass_name, ref_name, ref, definition))
+        return pending
+
+    def load_models(self, file_or_raw, create=True, lazy=False):
         raw_models = self._load_file(file_or_raw)
+        if not lazy:
+            self._build_models(raw_models.items(), self._get_class_builder(),
+                               create)
+            return
+        for class_definition, fields in raw_models.items():
+            class_name = class_definition.partition('|')[0]
+            # a redefined model goes after the models it might rely on
+            self._lazy_models.pop(class_name, None)
+            self._lazy_models[class_name] = LazyModel(class_definition,
+                                                      fields, create)
+            if self.in_context:
+                self._context_lazy_models.add(class_name)
+
+    def _build_lazy_model(self, class_name):
+        if class_name not in self._lazy_models:
+            raise KeyError(class_name)
+        self._build_lazy_models([class_name])
+        return self.class_registry[class_name]
+
+    def _discard_lazy_models(self, class_names):
+        # definitions relying on a discarded model can't be built anymore
+        todo = set(class_names)
+        while todo:
+            for class_name in todo:
+                self._lazy_models.pop(class_name, None)
+            todo = set(
+                k for (k, m) in self._lazy_models.items()
+                if todo.intersection(
+                    get_required_models(m.class_definition, m.fields)))
+
+    def _build_lazy_models(self, class_names):
+        required = set()
+        todo = [name for name in class_names if name in self._lazy_models]
+        while todo:
+            class_name = todo.pop()
+            if class_name in required or class_name not in self._lazy_models:
+                continue
+            required.add(class_name)
+            lazy_model = self._lazy_models[class_name]
+            todo.extend(
+                get_required_models(lazy_model.class_definition,
+                                    lazy_model.fields))
+        if not required:
+            return
+
+        # models are built in the order they were defined in
+        lazy_models = [
+            m for (k, m) in self._lazy_models.items() if k in required
+        ]
+        class_builder = self._get_class_builder()
+        for create, models in groupby(lazy_models, lambda m: m.create):
+            raw_models = [(m.class_definition, m.fields) for m in models]
+            self._build_models(raw_models, class_builder, create)
 
+    def _get_class_builder(self):
+        field_buider = self.options.field_builder()
+        return self.options.class_builder(self, field_buider).build_class
+
+    def _build_models(self, raw_models, class_builder, create=True):
+        # new models can add backrefs to the ones already loaded
+        self._model_info.clear()
+        if self._parked_models:
+            raw_models = list(raw_models)
+            self._invalidate_parked_models(raw_models)
         registry = {}
-        for class_definition, fields in raw_models.items():
+        for class_definition, fields in raw_models:
             class_info = self._parse_class_definition(class_definition)
-            klass = class_builder(class_info, fields['definition'])
+            # class builders without a ref argument keep working as long as
+            # the refs aren't indexed
+            kwargs = {}
+            if self.options.index_refs:
+                kwargs['ref'] = fields.get('ref')
+            with self._phase('build_models', class_info.class_name):
+                klass = class_builder(class_info, fields['definition'],
+                                      **kwargs)
             registry[class_info.class_name] = klass
             self.class_registry[class_info.class_name] = klass
+            self._lazy_models.pop(class_info.class_name, None)
         if self.in_context:
             self._context_registry.update(registry)
-        self.create_models(registry.keys())
+        if create:
+            with self._phase('create_models') as phase:
+                phase.rows += len(registry)
+                self.create_models(registry.keys())
 
     def load_instances(self,
                        file_or_raw,
                        auto_load=False,
                        instance_refs=None,
                        ref_mapping=None):
+        raw_instances = self._load_file(file_or_raw)
+        self._build_lazy_models(k.partition('|')[0] for k in raw_instances)
         classes = scan_current_models(self)
         self.class_registry.update(classes)
-        raw_instances = self._load_file(file_or_raw)
 
         # remove notion of subclassing
         raw_instances = {
@@ -345,80 +1373,128 @@ class FastAlchemy:
             self.options.separator,
             auto_load,
         )
+        self._expand_raw_instances(loader, raw_instances)
+        self._coerce_instances(raw_instances)
+
         if not instance_refs:
             instance_refs = {}
         instance_refs.update(self._pre_load_existing_instances(raw_instances))
 
-        self._initialisation(raw_instances, instance_refs,
-                             loader.load_instance)
-        self._initialisation(raw_instances, instance_refs,
-                             loader.link_relations)
+        with self._phase('sort_instances') as phase:
+            pending = loader.sort_instances(raw_instances)
+            phase.rows += len(pending)
+        if auto_load:
+            with self._phase('auto_load') as phase:
+                in_file = dict.fromkeys(p.ref for p in pending)
+                self._initialisation(raw_instances,
+                                     ChainMap(in_file, instance_refs),
+                                     loader.collect_missing_relations)
+                known = len(instance_refs)
+                loader.load_missing_relations(instance_refs)
+                phase.rows += len(instance_refs) - known
+                self.stats.record_instance_refs(len(instance_refs))
+
+        # instances are built and linked in the same pass
+        with self.session.no_autoflush:
+            for klass_name, group in groupby(pending,
+                                             lambda p: p.class_name):
+                group = list(group)
+                with self._phase('build_instances', klass_name) as phase:
+                    phase.rows += len(group)
+                    loader.load_sorted(group, instance_refs)
+                    self.stats.record_instance_refs(len(instance_refs))
+        self._collect_associations(loader)
 
         return instance_refs
 
     def _pre_load_existing_instances(self, raw_instances):
         instance_refs = {}
         for class_definition, fields in raw_instances.items():
-            physical_refs = []
-            for instance in fields.get('instances', []):
-                ref = get_ref_from_instance(instance, fields['ref'],
-                                            self.options.separator)
-                physical_refs.append(ref)
-
-            class_info = self._parse_class_definition(class_definition)
-            klass = self.class_registry[class_info.class_name]
-
-            # assemble data to construct filters with.
-            fltrs = []
-            relations = scan_all_relations(klass)
-            for rel, rel_klass in relations:
-                rel_klass = self.class_registry[rel_klass]
-                for ref in physical_refs:
-                    if rel in ref:
-                        definition = get_definition_from_physical_ref(
-                            ref[rel], raw_instances[rel_klass.__name__]['ref'],
-                            self.options.separator)
-                        definition = {
-                            k: v
-                            for k, v in definition.items()
-                            if k in scan_attributes(rel_klass) and v != 'None'
-                        }
-                        ref[rel] = definition
-
-            # transform filterdata into sqla filters
-            fltrs = []
-            rel_names = [r[0] for r in relations]
-            for ref in physical_refs:
-                fltr = []
-                for key, value in ref.items():
-                    if value == 'None':
-                        continue
-                    if isinstance(value, dict):
-                        if not value:
-                            continue
-                        if key in rel_names:
-                            fltr.append(getattr(klass, key).has(**value))
-                        else:
-                            attr = cast(getattr(klass, key), String())
-                            fltr.append(attr == json.dumps(value))
-                    else:
-                        fltr.append(getattr(klass, key) == value)
-                fltrs.append(and_(*fltr))
-            if not fltrs:
+            if not fields.get('instances'):
                 continue
+            class_info = self._parse_class_definition(class_definition)
+            with self._phase('pre_load', class_info.class_name) as phase:
+                found = self._pre_load_instances(class_info, fields,
+                                                 raw_instances)
+                phase.rows += len(found)
+                instance_refs.update(found)
+                self.stats.record_instance_refs(len(instance_refs))
+        return instance_refs
 
-            # load potentially existing instances
-            loaded_instances = self.session.query(klass).filter(
-                or_(*fltrs)).all()
-            for instance in loaded_instances:
-                instance_ref = instance_to_ref(
-                    raw_instances, instance, fields['ref'],
-                    self.options.separator, self.Model)
-                instance_ref = '{}|{}'.format(class_info.class_name,
-                                              instance_ref)
-                instance_refs[instance_ref] = instance
+    def _pre_load_instances(self, class_info, fields, raw_instances):
+        instance_refs = {}
+        klass = self.class_registry[class_info.class_name]
+        lookups = self._build_ref_lookups(klass, raw_instances,
+                                          fields['instances'], fields['ref'])
+
+        # load potentially existing instances
+        for columns, values in lookups.items():
+            qry, exprs = self._build_ref_query(klass, columns)
+            for fltr in chunked_filters(exprs, values,
+                                        self.options.chunk_size):
+                for instance in qry.filter(fltr):
+                    instance_ref = instance_to_ref(
+                        raw_instances, instance, fields['ref'],
+                        self.options.separator, self.Model)
+                    instance_ref = '{}|{}'.format(class_info.class_name,
+                                                  instance_ref)
+                    instance_refs[instance_ref] = instance
         return instance_refs
 
+    def _build_ref_lookups(self, klass, raw_instances, instances, ref):
+        # group the refs by the columns they filter on, relation parts of a
+        # ref are split into the ref columns of the related model
+        sep = self.options.separator
+        relations = dict(self.get_model_info(klass).relations)
+        lookups = OrderedDict()
+        for instance in instances:
+            columns = []
+            values = []
+            ref_values = get_ref_from_instance(instance, ref, sep)
+            for key, value in ref_values.items():
+                if value == 'None':
+                    continue
+                if key in relations:
+                    rel_klass = self.class_registry[relations[key]]
+                    definition = get_definition_from_physical_ref(
+                        value, raw_instances[relations[key]]['ref'], sep)
+                    rel_attributes = self.get_model_info(rel_klass).columns
+                    for rel_key, rel_value in definition.items():
+                        if rel_key in rel_attributes and rel_value != 'None':
+                            columns.append((key, rel_key))
+                            values.append(
+                                self.coerce_value(rel_klass, rel_key,
+                                                  rel_value))
+                elif isinstance(value, dict):
+                    if value:
+                        columns.append((key, dict))
+                        values.append(json.dumps(value))
+                else:
+                    columns.append((key, None))
+                    values.append(value)
+            lookups.setdefault(tuple(columns), OrderedDict())[tuple(
+                values)] = None
+        return OrderedDict((k, list(v)) for k, v in lookups.items())
+
+    def _build_ref_query(self, klass, columns):
+        qry = self.session.query(klass)
+        aliases = {}
+        exprs = []
+        for key, column in columns:
+            if column is None:
+                exprs.append(getattr(klass, key))
+            elif column is dict:
+                exprs.append(cast(getattr(klass, key), String()))
+            else:
+                if key not in aliases:
+                    rel = getattr(klass, key)
+                    alias = orm.aliased(rel.property.mapper.class_)
+                    qry = qry.join(rel.of_type(alias)).options(
+                        orm.contains_eager(rel.of_type(alias)))
+                    aliases[key] = alias
+                exprs.append(getattr(aliases[key], column))
+        return qry, exprs
+
     def _initialisation(self, raw_instances, instance_refs, execute_fn):
         for class_definition, fields in raw_instances.items():
             if not fields.get('instances'):
@@ -428,41 +1504,138 @@ class FastAlchemy:
                 execute_fn(class_info, fields['ref'], fields['instances'],
                            instance_refs)
 
+    def snapshot(self):
+        return take_snapshot(self.session, self.Model.metadata.sorted_tables,
+                             self.options.batch_size)
+
+    def restore(self, snapshot):
+        # instances in the session would be stale after restoring
+        self.session.close()
+        self._forget_loaded_instances()
+        snapshot.restore(self.session)
+        self.session.close()
+
     def __enter__(self):
+        if self.options.context_mode == SAVEPOINT:
+            self._begin_savepoint()
         self.in_context = True
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.options.context_mode == SAVEPOINT:
+            self._rollback_savepoint()
+            return
         self.in_context = False
+        self._discard_lazy_models(self._context_lazy_models)
+        self._context_lazy_models = set()
         self.drop_models(models=self._context_registry.keys())
         self._context_registry = {}
 
+    def _begin_savepoint(self):
+        if not self._savepoints:
+            # join the session into a transaction that is never committed
+            self.session.commit()
+            self.session.close()
+            self._connection = self.session.get_bind().connect()
+            self._transaction = self._connection.begin()
+            self._session_bind = self.session.bind
+            self.session.bind = self._connection
+        self.session.flush()
+
+        name = 'fast_alchemy_{}'.format(len(self._savepoints) + 1)
+        self._connection.execute(sa.text('SAVEPOINT {}'.format(name)))
+        self._savepoints.append((name, self._context_registry,
+                                 self._context_lazy_models))
+        self._context_registry = {}
+        self._context_lazy_models = set()
+
+    def _rollback_savepoint(self):
+        name, context_registry, context_lazy_models = self._savepoints.pop()
+        self.session.close()
+        self._connection.execute(
+            sa.text('ROLLBACK TO SAVEPOINT {}'.format(name)))
+
+        # the savepoint already removed the tables of models loaded in the
+        # context, if the database supports transactional DDL.
+        self._discard_lazy_models(self._context_lazy_models)
+        if self._context_registry:
+            self.drop_models(models=list(self._context_registry))
+        self._context_registry = context_registry
+        self._context_lazy_models = context_lazy_models
+
+        # reloads inside the savepoint are undone as well
+        self._forget_loaded_instances()
+        if not self._savepoints:
+            self._transaction.rollback()
+            self._connection.close()
+            self.session.bind = self._session_bind
+            self.in_context = False
+
+    def _forget_loaded_instances(self, models=None):
+        if models is None:
+            models = list(self._loaded_keys)
+        for model_name in models:
+            self._loaded_keys.pop(model_name, None)
+            self._loaded_identities.pop(model_name, None)
+
     def get_tables(self, models=None):
         if models is None:
             models = self.class_registry.keys()
-        return [
+        tables = [
             v.__table__ for (k, v) in self.class_registry.items()
             if k in models
         ]
+        # association tables come along once the models on both sides exist
+        metadata = self.Model.metadata
+        for table in get_secondary_tables(metadata, tables):
+            if all(fk.target_fullname.split('.')[0] in metadata.tables
+                   for fk in table.foreign_keys):
+                tables.append(table)
+        return tables
 
     def create_models(self, models=None):
         self.execute_for(self.get_tables(models), 'create_all')
 
     def drop_models(self, models=None):
-        self.execute_for(self.get_tables(models), 'drop_all')
-
         if models is None:
+            self._lazy_models.clear()
             models = self.class_registry.keys()
+        models = self._with_subclasses(models)
+        self._discard_lazy_models(models)
 
-        drop_models(
-            base_model=self.Model,
-            all_model_names=self.class_registry.keys(),
-            model_names_to_drop=models)
+        self.execute_for(self.get_tables(models), 'drop_all')
+        self._model_info.clear()
+        self._forget_loaded_instances(models)
+
+        # memoized models are parked so they can be registered again later
+        unloaded = []
+        for model_name in models:
+            klass = self.class_registry[model_name]
+            if model_name not in self._model_keys:
+                unloaded.append(klass)
+                continue
+            unregister_model(self.Model, klass)
+            key = self._model_keys.pop(model_name)
+            self._parked_models[model_name] = CachedModel(key, klass)
+
+        if unloaded:
+            self._unload_parked_models(unloaded)
+            drop_models(
+                base_model=self.Model,
+                all_model_names=self.class_registry.keys(),
+                model_names_to_drop=[k.__name__ for k in unloaded])
 
         for model_name in models:
             delattr(self, model_name)
             self.class_registry.pop(model_name)
 
+    def _with_subclasses(self, models):
+        classes = tuple(self.class_registry[name] for name in models)
+        return [
+            name for (name, klass) in self.class_registry.items()
+            if name in models or issubclass(klass, classes)
+        ]
+
     def execute_for(self, tables, operation):
         op = getattr(self.Model.metadata, operation)
         op(bind=self.session.bind, tables=tables)
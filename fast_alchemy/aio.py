@@ -0,0 +1,61 @@
+import asyncio
+
+from fast_alchemy import FastAlchemy
+
+
+class AsyncFastAlchemy:
+    def __init__(self, base, session, **kwargs):
+        self.session = session
+        # the sync api runs on the session wrapped by the AsyncSession,
+        # its queries go through the async driver when called via run_sync
+        self.fa = FastAlchemy(base, session.sync_session, **kwargs)
+
+    def __getattr__(self, name):
+        # loaded models are available on the sync instance
+        return getattr(self.fa, name)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await self.session.run_sync(lambda _: fn(*args, **kwargs))
+
+    async def _load_file(self, file_or_raw):
+        if not isinstance(file_or_raw, str):
+            return file_or_raw
+        # parsing doesn't need the database, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.fa._load_file,
+                                          file_or_raw)
+
+    async def load(self, filepath, bulk=False, stream=False):
+        if stream:
+            await self.load_stream(filepath, bulk=bulk)
+            return
+        raw = await self._load_file(filepath)
+        await self.run_sync(self.fa.load, raw, bulk=bulk)
+
+    async def load_stream(self, filepath, **kwargs):
+        return await self.run_sync(self.fa.load_stream, filepath, **kwargs)
+
+    async def load_incremental(self, file_or_raw, **kwargs):
+        raw = await self._load_file(file_or_raw)
+        await self.run_sync(self.fa.load_incremental, raw, **kwargs)
+
+    async def load_models(self, file_or_raw, create=True):
+        raw = await self._load_file(file_or_raw)
+        await self.run_sync(self.fa.load_models, raw, create=create)
+
+    async def load_instances(self, file_or_raw, **kwargs):
+        raw = await self._load_file(file_or_raw)
+        return await self.run_sync(self.fa.load_instances, raw, **kwargs)
+
+    async def create_models(self, models=None):
+        await self.run_sync(self.fa.create_models, models=models)
+
+    async def drop_models(self, models=None):
+        await self.run_sync(self.fa.drop_models, models=models)
+
+    async def __aenter__(self):
+        await self.run_sync(self.fa.__enter__)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.run_sync(self.fa.__exit__, exc_type, exc_val, exc_tb)
@@ -0,0 +1,199 @@
+from collections import OrderedDict, defaultdict
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+from sqlalchemy.inspection import inspect as sqla_inspect
+
+from .helpers import get_secondary_tables
+
+
+def get_pk_column(mapper):
+    pks = mapper.base_mapper.primary_key
+    if len(pks) != 1 or not isinstance(pks[0].type, sa.Integer):
+        msg = "Bulk loading requires a single integer primary key on {}"
+        raise Exception(msg.format(mapper.class_.__name__))
+    return pks[0]
+
+
+def get_column_value(mapper, instance, column):
+    # related instances can be loaded already, and only known by identity
+    if isinstance(instance, tuple):
+        keys = [
+            mapper.get_property_by_column(pk).key for pk in mapper.primary_key
+        ]
+        values = dict(zip(keys, instance))
+        return values[mapper.get_property_by_column(column).key]
+    mapper = sqla_inspect(instance).mapper
+    return getattr(instance, mapper.get_property_by_column(column).key)
+
+
+def has_default(column):
+    return column.default is not None or column.server_default is not None
+
+
+class BulkInserter:
+    def __init__(self, session, batch_size=1000):
+        self.session = session
+        self.batch_size = batch_size
+
+    def insert(self, instances):
+        states, rows = self.prepare(instances)
+        for table, table_rows in rows.items():
+            self.execute(table, table_rows)
+        self.attach(states)
+        return states
+
+    def prepare(self, instances):
+        states = self.collect_states(instances)
+        self.assign_primary_keys(states)
+        return states, self.build_rows(states)
+
+    def collect_states(self, instances):
+        # Let the session cascade the instances, so the insert order is the
+        # same as the one the unit of work would have used.
+        self.session.add_all(instances)
+        states = [sqla_inspect(o) for o in self.session.new]
+        states.sort(key=lambda state: state.insert_order)
+        for state in states:
+            self.session.expunge(state.obj())
+        return states
+
+    def assign_primary_keys(self, states):
+        by_table = OrderedDict()
+        for state in states:
+            pk_column = get_pk_column(state.mapper)
+            by_table.setdefault(pk_column, []).append(state)
+
+        for pk_column, table_states in by_table.items():
+            query = sa.select([sa.func.max(pk_column)])
+            next_id = (self.session.execute(query).scalar() or 0) + 1
+            for state in table_states:
+                key = state.mapper.get_property_by_column(pk_column).key
+                if state.dict.get(key) is None:
+                    state.dict[key] = next_id
+                next_id = max(next_id, state.dict[key]) + 1
+
+    def build_rows(self, states):
+        rows = defaultdict(list)
+        for state in states:
+            values = self._get_column_values(state)
+            for table in state.mapper.tables:
+                row = {}
+                for column in table.columns:
+                    value = values.get(column)
+                    if value is None and has_default(column):
+                        continue
+                    row[column.key] = value
+                rows[table].append(row)
+
+        tables = sa.schema.sort_tables(rows.keys())
+        return OrderedDict((table, rows[table]) for table in tables)
+
+    def _get_column_values(self, state):
+        mapper = state.mapper
+        values = {}
+        for prop in mapper.column_attrs:
+            value = state.dict.get(prop.key)
+            for column in prop.columns:
+                values[column] = value
+
+        for rel in mapper.relationships:
+            if rel.direction.name != 'MANYTOONE' or rel.key not in state.dict:
+                continue
+            related = state.dict[rel.key]
+            related_state = related and sqla_inspect(related)
+            for local, remote in rel.local_remote_pairs:
+                value = None
+                if related_state:
+                    prop = related_state.mapper.get_property_by_column(remote)
+                    value = related_state.dict.get(prop.key)
+                    if value is None and related_state.key:
+                        value = getattr(related, prop.key)
+                values[local] = value
+
+        if mapper.polymorphic_on is not None:
+            if values.get(mapper.polymorphic_on) is None:
+                values[mapper.polymorphic_on] = mapper.polymorphic_identity
+        return values
+
+    def execute(self, table, rows):
+        self.execute_many(table.insert(), rows)
+
+    def execute_many(self, statement, rows):
+        # executemany needs rows with the same keys
+        batches = OrderedDict()
+        for row in rows:
+            batches.setdefault(tuple(row), []).append(row)
+        for batch in batches.values():
+            for i in range(0, len(batch), self.batch_size):
+                self.session.execute(statement, batch[i:i + self.batch_size])
+
+    def update(self, instances):
+        # the instances only need their primary key to be set, they're never
+        # added to the session
+        states = [sqla_inspect(instance) for instance in instances]
+        for table, rows in self.build_rows(states).items():
+            pk_column = list(table.primary_key)[0]
+            param = 'old_{}'.format(pk_column.key)
+            statement = table.update().where(pk_column == sa.bindparam(param))
+            params = []
+            for row in rows:
+                row = dict(row)
+                row[param] = row.pop(pk_column.key)
+                if len(row) > 1:
+                    params.append(row)
+            self.execute_many(statement, params)
+
+    def delete(self, identities):
+        ids = OrderedDict()
+        for klass, identity in identities:
+            for table in sqla_inspect(klass).tables:
+                ids.setdefault(table, []).append(identity[0])
+        if not ids:
+            return
+
+        metadata = list(ids)[0].metadata
+        for secondary in get_secondary_tables(metadata, ids):
+            for fk in secondary.foreign_keys:
+                if fk.column.table in ids:
+                    self.delete_where(fk.parent, ids[fk.column.table])
+        # rows of a subclass go before the rows they extend
+        for table in reversed(sa.schema.sort_tables(ids.keys())):
+            self.delete_where(list(table.primary_key)[0], ids[table])
+
+    def delete_where(self, column, values):
+        for i in range(0, len(values), self.batch_size):
+            batch = values[i:i + self.batch_size]
+            self.session.execute(column.table.delete().where(
+                column.in_(batch)))
+
+    def associate(self, rel, pairs):
+        rows = self.build_association_rows(rel, pairs)
+        self.execute(rel.secondary, rows)
+        return len(rows)
+
+    def build_association_rows(self, rel, pairs):
+        rows = OrderedDict()
+        for instance, related in pairs:
+            row = OrderedDict()
+            for column, secondary_column in rel.synchronize_pairs:
+                row[secondary_column.key] = get_column_value(
+                    rel.parent, instance, column)
+            for column, secondary_column in rel.secondary_synchronize_pairs:
+                row[secondary_column.key] = get_column_value(
+                    rel.mapper, related, column)
+            rows[tuple(row.values())] = row
+        return list(rows.values())
+
+    def unassociate(self, rel, instances):
+        for column, secondary_column in rel.synchronize_pairs:
+            values = [
+                get_column_value(rel.parent, instance, column)
+                for instance in instances
+            ]
+            self.delete_where(secondary_column, values)
+
+    def attach(self, states):
+        for state in states:
+            orm.make_transient_to_detached(state.obj())
+        self.session.add_all([state.obj() for state in states])
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+
+from . import parse_field
+from .helpers import SafeLoader, check_file_type, ordered_load
+
+# pickles can run code when they're loaded, so the cache is kept per user
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME')
+    or os.path.join(os.path.expanduser('~'), '.cache'), 'fast-alchemy')
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+CACHE_EXTENSION = '.pickle'
+
+
+def compile_definitions(raw):
+    for fields in raw.values():
+        definition = fields.get('definition') or {}
+        for field_name, field_definition in definition.items():
+            if isinstance(field_definition, str):
+                definition[field_name] = parse_field(field_name,
+                                                     field_definition)
+    return raw
+
+
+class CachingFileLoader:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def __call__(self, filename):
+        check_file_type(filename)
+        with open(filename, 'rb') as fh:
+            content = fh.read()
+
+        self.check_cache_dir()
+        path = self.get_cache_path(filename, content)
+        try:
+            with open(path, 'rb') as fh:
+                raw = pickle.load(fh)
+            os.utime(path)
+            return raw
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        raw = compile_definitions(ordered_load(content, Loader=SafeLoader))
+        self.store(path, raw)
+        return raw
+
+    def check_cache_dir(self):
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        info = os.stat(self.cache_dir)
+        if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+            raise Exception('Cache directory {} is not owned by the current '
+                            'user'.format(self.cache_dir))
+        if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise Exception('Cache directory {} can be written to by other '
+                            'users'.format(self.cache_dir))
+
+    def get_cache_path(self, filename, content):
+        key = hashlib.sha1(os.path.abspath(filename).encode('utf-8'))
+        key.update(hashlib.sha1(content).digest())
+        return os.path.join(self.cache_dir, key.hexdigest() + CACHE_EXTENSION)
+
+    def store(self, path, raw):
+        # write to a temporary file first, parallel loaders could read it
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(raw, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_EXTENSION):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+
+        total_size = sum(size for (_, size, _) in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_EXTENSION):
+                os.remove(os.path.join(self.cache_dir, name))
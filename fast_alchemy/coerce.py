@@ -0,0 +1,156 @@
+import datetime
+import decimal
+
+import sqlalchemy as sa
+from sqlalchemy.inspection import inspect as sqla_inspect
+
+DATE_FORMATS = ['%Y-%m-%d']
+DATETIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d'
+]
+TIME_FORMATS = ['%H:%M:%S', '%H:%M:%S.%f', '%H:%M']
+BOOLEANS = {
+    'true': True,
+    'yes': True,
+    'on': True,
+    '1': True,
+    'false': False,
+    'no': False,
+    'off': False,
+    '0': False,
+}
+COERCION_ERRORS = (TypeError, ValueError, ArithmeticError)
+
+
+def parse_formats(value, formats):
+    for fmt in formats:
+        try:
+            return datetime.datetime.strptime(str(value).strip(), fmt)
+        except ValueError:
+            pass
+    raise ValueError('expected a format like {}'.format(' or '.join(formats)))
+
+
+def to_int(value):
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError('expected a whole number')
+    return int(value)
+
+
+def to_decimal(value):
+    # going through str keeps floats from adding binary noise
+    return decimal.Decimal(str(value).strip())
+
+
+def to_str(value):
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return str(value)
+    return value
+
+
+def to_bool(value):
+    key = str(value).strip().lower()
+    if key not in BOOLEANS:
+        raise ValueError('expected one of {}'.format(', '.join(BOOLEANS)))
+    return BOOLEANS[key]
+
+
+def to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return parse_formats(value, DATE_FORMATS).date()
+
+
+def to_datetime(value):
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return parse_formats(value, DATETIME_FORMATS)
+
+
+def to_time(value):
+    return parse_formats(value, TIME_FORMATS).time()
+
+
+CONVERTERS = {
+    int: to_int,
+    float: float,
+    decimal.Decimal: to_decimal,
+    str: to_str,
+    bool: to_bool,
+    datetime.date: to_date,
+    datetime.datetime: to_datetime,
+    datetime.time: to_time,
+}
+
+
+def enum_converter(column_type):
+    enum_class = column_type.enum_class
+    choices = column_type.enums
+
+    def to_enum(value):
+        if enum_class is not None and value in enum_class.__members__:
+            return enum_class[value]
+        if enum_class is not None or value not in choices:
+            raise ValueError('expected one of {}'.format(', '.join(choices)))
+        return value
+
+    return to_enum
+
+
+def get_converter(column_type):
+    if isinstance(column_type, sa.Enum):
+        # plain string values still have to be one of the choices
+        return column_type.enum_class, enum_converter(column_type)
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        return None
+    if python_type not in CONVERTERS:
+        return None
+    return python_type, CONVERTERS[python_type]
+
+
+def get_converters(klass):
+    converters = {}
+    for prop in sqla_inspect(klass).column_attrs:
+        converter = get_converter(prop.columns[0].type)
+        if converter is not None:
+            converters[prop.key] = converter
+    return converters
+
+
+def coerce_instances(converters, instances):
+    # values are converted column by column, every invalid one is reported
+    errors = []
+    for key, (python_type, convert) in converters.items():
+        for idx, definition in enumerate(instances):
+            value = definition.get(key)
+            if value is None or type(value) is python_type:
+                continue
+            try:
+                definition[key] = convert(value)
+            except COERCION_ERRORS as e:
+                errors.append((idx, key, value, e))
+    return errors
+
+
+def coerce_value(converters, key, value):
+    if key not in converters or value is None:
+        return value
+    try:
+        return converters[key][1](value)
+    except COERCION_ERRORS:
+        return value
+
+
+def format_errors(errors):
+    lines = []
+    for klass_name, klass_errors in errors:
+        for idx, key, value, e in sorted(klass_errors):
+            lines.append('    {} instance {}, {}: {!r} ({})'.format(
+                klass_name, idx + 1, key, value, e))
+    return 'Could not convert {} values:\n{}'.format(
+        len(lines), '\n'.join(lines))
@@ -1,12 +1,30 @@
-from collections import defaultdict
+import copy
+import csv
+import os
+from collections import OrderedDict, defaultdict
 
 import sqlalchemy as sa
-from fast_alchemy import ClassInfo, FastAlchemy, FieldInfo, Options
+from fast_alchemy import (MANY_TO_MANY, UNIQUE, ClassInfo, FastAlchemy,
+                          Options, get_ref_index, get_secondary_columns,
+                          get_secondary_joins, get_secondary_name,
+                          parse_field)
+from fast_alchemy.stats import LoadStats
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.declarative import declarative_base
 
 NO_COLUMN_FOR = ['relationship']
 FIELD_LOCATION_STRINGS = {sa: 'sa', sa.orm: 'sa.orm'}
 
 COLUMN_TEMPLATE = """    {} = sa.Column({}{})"""
+SECONDARY_TEMPLATE = """{0} = sa.Table(
+    '{0}',
+    Base.metadata,
+{1})"""
+SECONDARY_COLUMN_TEMPLATE = (
+    """    sa.Column('{}', sa.Integer, sa.ForeignKey('{}.id'), """
+    """primary_key=True)""")
+TABLE_ARGS_TEMPLATE = """    __table_args__ = ({}, )
+"""
 MAPPER_TEMPLATE = """    __mapper_args__ = {{
         {}
     }}
@@ -27,7 +45,15 @@ class FastAlchemyExporter(FastAlchemy):
         kwargs['class_builder'] = kwargs.pop('class_builder', ClassExporter)
         self.options = Options(**kwargs)
         self.class_registry = {}
+        self._lazy_models = OrderedDict()
+        self._model_info = {}
+        self._model_keys = {}
+        self._parked_models = {}
         self.in_context = False
+        self.stats = LoadStats()
+
+    def _phase(self, phase, model=None):
+        return self.stats.phase(phase, model)
 
     def export_to_python(self, file_or_raw, fileobj):
         self.load_models(file_or_raw)
@@ -37,6 +63,43 @@ class FastAlchemyExporter(FastAlchemy):
             fileobj.write(class_definition)
         fileobj.write('\n\n\nBase.metadata.create_all()\n')
 
+    def export_instances(self,
+                         file_or_raw,
+                         sql_file=None,
+                         csv_dir=None,
+                         dialect=None):
+        rows = self.resolve_rows(self._load_file(file_or_raw))
+        if sql_file is not None:
+            write_sql(rows, sql_file, dialect or sqlite.dialect(),
+                      self.options.batch_size)
+        if csv_dir is not None:
+            write_csv(rows, csv_dir)
+        return rows
+
+    def resolve_rows(self, raw):
+        # the instances are resolved against real models in a scratch
+        # database, so the primary keys start at 1
+        engine = sa.create_engine('sqlite://')
+        session = sa.orm.sessionmaker(
+            autocommit=False, autoflush=False, bind=engine)()
+        fa = FastAlchemy(
+            declarative_base(), session, separator=self.options.separator)
+        raw = copy.deepcopy(raw)
+        fa.load_models(
+            OrderedDict((k, v) for (k, v) in raw.items() if 'definition' in v))
+        instances = fa.load_instances(raw)
+
+        inserter = self.options.bulk_inserter(session, self.options.batch_size)
+        _, rows = inserter.prepare(instances.values())
+        for rel, pairs in fa._pending_associations.items():
+            rows.setdefault(rel.secondary, []).extend(
+                inserter.build_association_rows(rel, pairs))
+        tables = sa.schema.sort_tables(rows.keys())
+        rows = OrderedDict((table, rows[table]) for table in tables)
+        session.close()
+        engine.dispose()
+        return rows
+
     def create_models(self, *args, **kwargs):
         pass
 
@@ -50,11 +113,44 @@ class FastAlchemyExporter(FastAlchemy):
         return ClassInfo(class_name, inherits_class, inherits_name)
 
 
+def write_sql(rows, fileobj, dialect, batch_size=1000):
+    fileobj.write('BEGIN;\n')
+    for table, table_rows in rows.items():
+        # multi row inserts need rows with the same keys
+        batches = OrderedDict()
+        for row in table_rows:
+            batches.setdefault(tuple(row), []).append(row)
+        for batch in batches.values():
+            for i in range(0, len(batch), batch_size):
+                statement = table.insert().values(batch[i:i + batch_size])
+                compiled = statement.compile(
+                    dialect=dialect, compile_kwargs={'literal_binds': True})
+                fileobj.write('{};\n'.format(compiled))
+    fileobj.write('COMMIT;\n')
+
+
+def write_csv(rows, directory):
+    os.makedirs(directory, exist_ok=True)
+    for table, table_rows in rows.items():
+        keys = [column.key for column in table.columns]
+        path = os.path.join(directory, '{}.csv'.format(table.name))
+        with open(path, 'w', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(keys)
+            for row in table_rows:
+                writer.writerow([
+                    '' if row.get(key) is None else row[key] for key in keys
+                ])
+
+
 class FieldExporter:
     def build_field(self, field_info, class_name, backrefs):
         fields = []
         kwargs = {}
 
+        if field_info.field_definition == MANY_TO_MANY:
+            return [self._build_many_to_many(field_info, class_name, backrefs)]
+
         if field_info.field_definition == 'relationship':
             fields.append(self._build_relation(field_info))
             kwargs['backref'] = "'{}'".format(
@@ -93,6 +189,22 @@ class FieldExporter:
 
         return relation_field
 
+    def _build_many_to_many(self, field_info, class_name, backrefs):
+        target = field_info.field_args[0]
+        secondary = get_secondary_name(class_name, field_info.field_name)
+        params = ["'{}'".format(target), 'secondary={}'.format(secondary)]
+        backref = backrefs[class_name].get(target)
+        if backref:
+            params.append("backref='{}'".format(backref))
+        joins = get_secondary_joins(class_name, target, secondary)
+        params.extend("{}='{}'".format(*join) for join in joins.items())
+        if joins:
+            # the explicit joins don't fit on a single line
+            return """    {} = sa.orm.relationship(\n        {})""".format(
+                field_info.field_name, ',\n        '.join(params))
+        return """    {} = sa.orm.relationship({})""".format(
+            field_info.field_name, ', '.join(params))
+
 
 class ClassExporter:
     def __init__(self, db, field_builder):
@@ -101,11 +213,7 @@ class ClassExporter:
         self.field_builder = field_builder.build_field
 
     def _parse_field(self, field_name, field_definition):
-        field_args = []
-        if '|' in field_definition:
-            field_definition, args = field_definition.split('|')
-            field_args = args.split(',')
-        return FieldInfo(field_name, field_definition, field_args)
+        return parse_field(field_name, field_definition)
 
     def _parse_fields(self, fields, class_name):
         for field_name, field_definition in fields.items():
@@ -130,13 +238,37 @@ class ClassExporter:
         pk_args.append('primary_key=True')
         return COLUMN_TEMPLATE.format('id', 'sa.Integer, ', ', '.join(pk_args))
 
-    def build_class(self, class_info, fields):
+    def _build_ref_index(self, tablename, ref_index):
+        columns = ', '.join("'{}'".format(c) for c in ref_index.columns)
+        if ref_index.kind == UNIQUE:
+            return "sa.UniqueConstraint({}, name='uq_{}_ref')".format(
+                columns, tablename)
+        return "sa.Index('ix_{}_ref', {})".format(tablename, columns)
+
+    def _build_secondary(self, tablename, field_info):
+        target_tablename = field_info.field_args[0].lower()
+        columns = get_secondary_columns(tablename, target_tablename)
+        targets = (tablename, target_tablename)
+        return SECONDARY_TEMPLATE.format(
+            get_secondary_name(tablename, field_info.field_name),
+            ',\n'.join(
+                SECONDARY_COLUMN_TEMPLATE.format(column, target)
+                for (column, target) in zip(columns, targets)))
+
+    def build_class(self, class_info, fields, ref=None):
         class_name = class_info.class_name
         tablename = class_name.lower()
 
         attributes = [
             "    __tablename__ = '{}'\n".format(tablename),
         ]
+        options = self.db.options
+        ref_index = get_ref_index(fields, ref, options.index_refs,
+                                  options.separator)
+        if ref_index:
+            attributes.append(
+                TABLE_ARGS_TEMPLATE.format(
+                    self._build_ref_index(tablename, ref_index)))
         if class_info.inherits_name or 'polymorphic' in fields:
             polymorphic_def = fields.pop('polymorphic', {})
             polymorphic_def['identity'] = class_info.class_name.lower()
@@ -147,11 +279,15 @@ class ClassExporter:
 
         attributes.append(self._build_pk(class_info))
 
+        secondary_tables = []
         for field_info in self._parse_fields(fields, class_name):
+            if field_info.field_definition == MANY_TO_MANY:
+                secondary_tables.append(
+                    self._build_secondary(tablename, field_info))
             attributes.extend(
                 self.field_builder(field_info, class_name, self.backrefs))
 
         class_attributes = '\n'.join(attributes)
         class_def = 'class {}({}):\n{}'.format(
             class_name, class_info.inherits_class[0], class_attributes)
-        return class_def
+        return '\n\n\n'.join(secondary_tables + [class_def])
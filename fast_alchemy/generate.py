@@ -0,0 +1,87 @@
+import random
+
+
+def parse_value(value):
+    if not isinstance(value, str):
+        return value
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value.strip()
+
+
+def sequence(rng, start=0, step=1):
+    return lambda index, row: start + index * step
+
+
+def value_range(rng, start, stop, step=1):
+    values = range(start, stop, step)
+    return lambda index, row: values[index % len(values)]
+
+
+def random_value(rng, low, high):
+    if isinstance(low, int) and isinstance(high, int):
+        return lambda index, row: rng.randint(low, high)
+    return lambda index, row: rng.uniform(low, high)
+
+
+def choice(rng, *values):
+    return lambda index, row: rng.choice(values)
+
+
+def cycle(rng, *values):
+    # spreads the generated instances evenly over the given values
+    return lambda index, row: values[index % len(values)]
+
+
+def template(rng, value):
+    return lambda index, row: value.format(index=index, **row)
+
+
+GENERATORS = {
+    'sequence': sequence,
+    'range': value_range,
+    'random': random_value,
+    'choice': choice,
+    'cycle': cycle,
+    'template': template,
+}
+
+
+def compile_field(rng, field_name, field_definition):
+    if isinstance(field_definition, dict) and len(field_definition) == 1:
+        kind, args = list(field_definition.items())[0]
+        if not isinstance(args, list):
+            args = [args]
+    elif isinstance(field_definition, str) and '|' in field_definition:
+        kind, args = field_definition.split('|', 1)
+        # templates can hold the separator themselves
+        args = [args] if kind == 'template' else args.split(',')
+    else:
+        return lambda index, row: field_definition
+
+    if kind not in GENERATORS:
+        msg = '{} of {} is not a known generator, use one of {}'
+        raise Exception(
+            msg.format(kind, field_name, ', '.join(sorted(GENERATORS))))
+    if kind != 'template':
+        args = [parse_value(arg) for arg in args]
+    try:
+        return GENERATORS[kind](rng, *args)
+    except (TypeError, ValueError) as e:
+        msg = 'Could not build a {} generator for {} using {}: {}'
+        raise Exception(msg.format(kind, field_name, args, e))
+
+
+def generate_instances(spec):
+    rng = random.Random(spec.get('seed'))
+    fields = [(field_name, compile_field(rng, field_name, field_definition))
+              for (field_name,
+                   field_definition) in spec.get('fields', {}).items()]
+    for index in range(spec['count']):
+        row = {}
+        for field_name, generate in fields:
+            row[field_name] = generate(index, row)
+        yield row
@@ -1,11 +1,16 @@
 import os
 from collections import OrderedDict
+from itertools import islice
 
 import sqlalchemy
 import yaml
 from packaging import version
+from sqlalchemy.inspection import inspect as sqla_inspect
+from sqlalchemy.util import WeakSequence
 
 SUPPORTED_FILE_TYPES = ['.yaml', '.yml']
+SECONDARY = 'fast_alchemy_secondary'
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 
 class UnsupportedFileType(Exception):
@@ -14,8 +19,7 @@ class UnsupportedFileType(Exception):
 
 # credit to https://stackoverflow.com/
 # questions/5121931/in-python-how-can-you-load-yaml-mappings-as-ordereddicts
-def ordered_load(stream, Loader=yaml.SafeLoader,
-                 object_pairs_hook=OrderedDict):
+def get_ordered_loader(Loader=yaml.SafeLoader, object_pairs_hook=OrderedDict):
     class OrderedLoader(Loader):
         pass
 
@@ -25,7 +29,68 @@ def ordered_load(stream, Loader=yaml.SafeLoader,
 
     OrderedLoader.add_constructor(
         yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, construct_mapping)
-    return yaml.load(stream, OrderedLoader)
+    return OrderedLoader
+
+
+def ordered_load(stream, Loader=yaml.SafeLoader,
+                 object_pairs_hook=OrderedDict):
+    return yaml.load(stream, get_ordered_loader(Loader, object_pairs_hook))
+
+
+# walks the yaml events of a file and yields a (class_definition, fields,
+# instances) tuple per model, where instances is a lazy iterator
+def ordered_stream(stream, Loader=yaml.SafeLoader):
+    loader = get_ordered_loader(Loader)(stream)
+
+    def construct_next():
+        return loader.construct_document(loader.compose_node(None, None))
+
+    def expect(event_type):
+        event = loader.get_event()
+        if not isinstance(event, event_type):
+            raise yaml.YAMLError('Expected {}, got {}'.format(
+                event_type.__name__, event))
+
+    def iter_instances():
+        while not loader.check_event(yaml.SequenceEndEvent):
+            yield construct_next()
+        loader.get_event()
+
+    try:
+        expect(yaml.StreamStartEvent)
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        expect(yaml.DocumentStartEvent)
+        expect(yaml.MappingStartEvent)
+        while not loader.check_event(yaml.MappingEndEvent):
+            class_definition = construct_next()
+            expect(yaml.MappingStartEvent)
+            fields = OrderedDict()
+            instances = None
+            while not loader.check_event(yaml.MappingEndEvent):
+                key = construct_next()
+                if instances is not None:
+                    msg = "'{}' of {} has to be defined before its instances"
+                    raise yaml.YAMLError(msg.format(key, class_definition))
+                if key == 'instances' and loader.check_event(
+                        yaml.SequenceStartEvent):
+                    loader.get_event()
+                    instances = iter_instances()
+                    yield class_definition, fields, instances
+                    # drain whatever the consumer did not read
+                    for _ in instances:
+                        pass
+                else:
+                    fields[key] = construct_next()
+            loader.get_event()
+            if instances is None:
+                instances = fields.pop('instances', None) or []
+                # external sources are passed on as they are
+                if not isinstance(instances, str):
+                    instances = iter(instances)
+                yield class_definition, fields, instances
+    finally:
+        loader.dispose()
 
 
 def scan_current_models(db):
@@ -36,13 +101,46 @@ def scan_current_models(db):
     return classes
 
 
-def load_file(filename):
+def chunked_filters(exprs, values, chunk_size):
+    if not exprs:
+        yield sqlalchemy.true()
+        return
+    # keep the amount of bound parameters per statement below chunk_size
+    rows_per_chunk = max(1, chunk_size // len(exprs))
+    for i in range(0, len(values), rows_per_chunk):
+        chunk = values[i:i + rows_per_chunk]
+        if len(exprs) == 1:
+            yield exprs[0].in_([value for (value, ) in chunk])
+        else:
+            yield sqlalchemy.tuple_(*exprs).in_(chunk)
+
+
+def iter_batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def check_file_type(filename):
     ext = os.path.splitext(filename)[-1]
     if ext not in SUPPORTED_FILE_TYPES:
         raise UnsupportedFileType(
             '{} not is not a supported file type'.format(ext))
+
+
+def load_file(filename):
+    check_file_type(filename)
+    with open(filename, 'r') as fh:
+        return ordered_load(fh, Loader=SafeLoader)
+
+
+def stream_file(filename):
+    check_file_type(filename)
     with open(filename, 'r') as fh:
-        return ordered_load(fh)
+        for item in ordered_stream(fh):
+            yield item
 
 
 def get_registered_models_1_3(base_model):
@@ -50,12 +148,14 @@ def get_registered_models_1_3(base_model):
 
 
 def drop_models_1_3(base_model, all_model_names, model_names_to_drop):
+    tables = []
     for model_name in model_names_to_drop:
         reg = base_model._decl_class_registry['_sa_module_registry']
         reg.contents["fast_alchemy"]._remove_item(model_name)
         base_model._decl_class_registry.pop(model_name)
-        base_model.metadata.remove(
-            base_model.metadata.tables[model_name.lower()])
+        tables.append(base_model.metadata.tables[model_name.lower()])
+        base_model.metadata.remove(tables[-1])
+    remove_secondary_tables(base_model.metadata, tables)
 
 
 def get_registered_models_1_4(base_model):
@@ -63,23 +163,136 @@ def get_registered_models_1_4(base_model):
 
 
 def drop_models_1_4(base_model, all_model_names, model_names_to_drop):
-    to_redeclare = set(all_model_names).difference(model_names_to_drop)
-
     registry = base_model.registry
-    registered_classes = registry._class_registry.items()
-    models = {k: v for k, v in registered_classes if k in all_model_names}
-    registry.dispose()
+    registry.configure()
+    classes = dict(get_registered_models_1_4(base_model))
+    dropped = set()
+    for model_name in model_names_to_drop:
+        dropped.update(sqla_inspect(classes[model_name]).self_and_descendants)
+
+    # relations of the remaining models pointing to the dropped ones, which
+    # includes the backrefs created by the dropped models
+    for manager in list(registry._managers):
+        mapper = manager.mapper
+        if mapper in dropped:
+            continue
+        for rel in list(mapper.relationships):
+            if rel.parent is mapper and rel.mapper in dropped:
+                remove_relationship(rel)
+
+    remove_secondary_tables(
+        base_model.metadata,
+        [own_table(mapper.class_) for mapper in dropped])
+    for mapper in dropped:
+        parent = mapper.inherits
+        if parent is not None and parent not in dropped:
+            parent._inheriting_mappers = WeakSequence(
+                m for m in parent._inheriting_mappers if m is not mapper)
+            mapper.polymorphic_map.pop(mapper.polymorphic_identity, None)
+            parent._expire_memoizations()
+        registry._managers.pop(mapper.class_manager, None)
+        registry._dispose_manager_and_mapper(mapper.class_manager)
+
+        table = mapper.local_table
+        if parent is not None and table is parent.local_table:
+            continue
+        if table.key in base_model.metadata.tables:
+            base_model.metadata.remove(table)
+
+
+def remove_relationship(rel):
+    mapper = rel.parent
+    for reverse in rel._reverse_property:
+        reverse._reverse_property.discard(rel)
+
+    # declarative refuses to delete mapped attributes of a mapped class
+    type.__delattr__(mapper.class_, rel.key)
+    mapper.class_manager.local_attrs.pop(rel.key, None)
+    for sub_mapper in mapper.self_and_descendants:
+        sub_mapper.class_manager.pop(rel.key, None)
+        sub_mapper.class_manager._reset_memoizations()
+        sub_mapper._props.pop(rel.key, None)
+        sub_mapper._expire_memoizations()
+
+
+def get_secondary_tables(metadata, tables):
+    # association tables go along with the models on either side
+    names = set(table.name for table in tables if table is not None)
+    secondary_tables = []
+    for table in metadata.tables.values():
+        if not table.info.get(SECONDARY):
+            continue
+        referred = [
+            fk.target_fullname.split('.')[0] for fk in table.foreign_keys
+        ]
+        if names.intersection(referred):
+            secondary_tables.append(table)
+    return secondary_tables
+
+
+def remove_secondary_tables(metadata, tables):
+    for table in get_secondary_tables(metadata, tables):
+        metadata.remove(table)
+
+
+def add_secondary_tables(metadata, klass):
+    for rel in sqla_inspect(klass).relationships:
+        table = rel.secondary
+        if table is not None and table.info.get(SECONDARY):
+            metadata._add_table(table.name, table.schema, table)
+
+
+def own_table(klass):
+    # single table inheritance shares the table of the parent
+    mapper = sqla_inspect(klass)
+    if mapper.inherits and mapper.local_table is mapper.inherits.local_table:
+        return None
+    return mapper.local_table
+
+
+def register_model_1_3(base_model, klass):
+    from sqlalchemy.ext.declarative.clsregistry import add_class
+    add_class(klass.__name__, klass)
+    table = own_table(klass)
+    if table is not None:
+        base_model.metadata._add_table(table.name, table.schema, table)
+    add_secondary_tables(base_model.metadata, klass)
+
+
+def unregister_model_1_3(base_model, klass):
+    reg = base_model._decl_class_registry['_sa_module_registry']
+    reg.contents[klass.__module__]._remove_item(klass.__name__)
+    base_model._decl_class_registry.pop(klass.__name__)
+    table = own_table(klass)
+    if table is not None:
+        base_model.metadata.remove(table)
+        remove_secondary_tables(base_model.metadata, [table])
+
+
+def register_model_1_4(base_model, klass):
+    from sqlalchemy.orm.clsregistry import add_class
+    add_class(klass.__name__, klass, base_model.registry._class_registry)
+    table = own_table(klass)
+    if table is not None:
+        base_model.metadata._add_table(table.name, table.schema, table)
+    add_secondary_tables(base_model.metadata, klass)
 
-    for model_name in to_redeclare:
-        registry.map_declaratively(models[model_name])
 
-    for model_name in models:
-        base_model.metadata.remove(
-            base_model.metadata.tables[model_name.lower()])
+def unregister_model_1_4(base_model, klass):
+    from sqlalchemy.orm.clsregistry import remove_class
+    remove_class(klass.__name__, klass, base_model.registry._class_registry)
+    table = own_table(klass)
+    if table is not None:
+        base_model.metadata.remove(table)
+        remove_secondary_tables(base_model.metadata, [table])
 
 
 get_registered_models = get_registered_models_1_3
 drop_models = drop_models_1_3
+register_model = register_model_1_3
+unregister_model = unregister_model_1_3
 if version.parse(sqlalchemy.__version__) >= version.parse("1.4.0"):
     get_registered_models = get_registered_models_1_4
     drop_models = drop_models_1_4
+    register_model = register_model_1_4
+    unregister_model = unregister_model_1_4
@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+from concurrent import futures
+
+import sqlalchemy as sa
+
+from .bulk import BulkInserter
+
+
+def get_engine(bind):
+    if not isinstance(bind, sa.engine.Engine):
+        raise Exception('Parallel loading needs a session bound to an '
+                        'engine, not to {}'.format(type(bind).__name__))
+    url = bind.url
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '',
+                                                               ':memory:'):
+        # every connection would get a database of its own
+        raise Exception('Parallel loading needs a database file, not an '
+                        'in-memory sqlite database')
+    return bind
+
+
+def get_prerequisites(tables):
+    # only tables that come earlier in the insert order are waited for, so
+    # circular foreign keys can't keep a table waiting forever
+    order = {table: idx for (idx, table) in enumerate(tables)}
+    prerequisites = OrderedDict()
+    for table in tables:
+        prerequisites[table] = set(
+            fk.column.table for fk in table.foreign_keys
+            if order.get(fk.column.table, order[table]) < order[table])
+    return prerequisites
+
+
+def get_row_filter(table):
+    columns = list(table.primary_key) or list(table.columns)
+    return sa.and_(*[
+        column == sa.bindparam('pk_{}'.format(column.key))
+        for column in columns
+    ]), columns
+
+
+class ParallelInserter(BulkInserter):
+    def __init__(self, session, batch_size=1000, workers=4):
+        super().__init__(session, batch_size)
+        self.workers = workers
+        self.engine = get_engine(session.bind)
+        # sqlite has a single writer, and connections waiting on its lock
+        # give up after the busy timeout, so tables take turns instead
+        if self.engine.dialect.name == 'sqlite':
+            self.write_lock = threading.Lock()
+        else:
+            self.write_lock = threading.BoundedSemaphore(workers)
+
+    def insert(self, instances, associations=None):
+        states, rows = self.prepare(instances)
+        for rel, pairs in (associations or {}).items():
+            rows.setdefault(rel.secondary, []).extend(
+                self.build_association_rows(rel, pairs))
+        # the transaction of the session would hold up the other connections
+        self.session.rollback()
+        self.insert_rows(rows)
+        self.attach(states)
+        return states
+
+    def insert_rows(self, rows):
+        pending = get_prerequisites(list(rows))
+        committed = []
+        skipped = set()
+        errors = {}
+        with futures.ThreadPoolExecutor(self.workers) as executor:
+            running = {}
+            while pending or running:
+                for table, prerequisites in list(pending.items()):
+                    if prerequisites & (skipped | set(errors)):
+                        skipped.add(pending.pop(table))
+                    elif prerequisites.issubset(committed):
+                        pending.pop(table)
+                        future = executor.submit(self.insert_table, table,
+                                                 rows[table])
+                        running[future] = table
+                if not running:
+                    break
+                done, _ = futures.wait(
+                    running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    table = running.pop(future)
+                    try:
+                        future.result()
+                        committed.append(table)
+                    except Exception as e:
+                        errors[table] = e
+
+        if errors:
+            self.remove_rows(rows, committed)
+            # errors are reported in insert order, not in order of failure
+            failed = [
+                '    {}: {}'.format(table.name, errors[table])
+                for table in rows if table in errors
+            ]
+            raise Exception('Nothing was loaded, inserting failed for:\n{}'.
+                            format('\n'.join(failed)))
+
+    def insert_table(self, table, rows):
+        # a connection executes statements the same way a session does
+        with self.write_lock, self.engine.begin() as connection:
+            BulkInserter(connection, self.batch_size).execute(table, rows)
+
+    def remove_rows(self, rows, committed):
+        # tables that did make it in are emptied again, dependents first
+        with self.engine.begin() as connection:
+            inserter = BulkInserter(connection, self.batch_size)
+            for table in reversed([t for t in rows if t in committed]):
+                fltr, columns = get_row_filter(table)
+                params = [{
+                    'pk_{}'.format(column.key): row.get(column.key)
+                    for column in columns
+                } for row in rows[table]]
+                inserter.execute_many(table.delete().where(fltr), params)
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import pickle
+import shutil
+from collections import OrderedDict, namedtuple
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declarative_base
+
+from fast_alchemy import SAVEPOINT, FastAlchemy
+
+from .cache import compile_definitions
+from .helpers import load_file
+
+TemplateDatabase = namedtuple('TemplateDatabase', 'path,models_path')
+MODELS_EXTENSION = '.models'
+
+
+def pytest_addoption(parser):
+    parser.addini(
+        'fast_alchemy_files',
+        type='linelist',
+        help='yaml files loaded into the fast-alchemy template database')
+
+
+def get_template_name(files):
+    key = hashlib.sha1()
+    for filename in files:
+        key.update(os.path.abspath(filename).encode('utf-8'))
+        with open(filename, 'rb') as fh:
+            key.update(hashlib.sha1(fh.read()).digest())
+    return 'fast-alchemy-{}.sqlite'.format(key.hexdigest())
+
+
+def create_session(path):
+    engine = sa.create_engine('sqlite:///{}'.format(path))
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    return declarative_base(), sa.orm.scoped_session(Session)
+
+
+def close_session(session):
+    engine = session.get_bind()
+    session.remove()
+    engine.dispose()
+
+
+def build_template(files, path):
+    models = OrderedDict()
+    for filename in files:
+        for class_definition, fields in load_file(filename).items():
+            if 'definition' in fields:
+                models[class_definition] = {
+                    'definition': fields['definition']
+                }
+    with open(path + MODELS_EXTENSION, 'wb') as fh:
+        pickle.dump(compile_definitions(models), fh)
+
+    tmp_path = path + '.tmp'
+    Base, session = create_session(tmp_path)
+    fa = FastAlchemy(Base, session)
+    for filename in files:
+        fa.load(filename)
+    close_session(session)
+    # the template only exists once it's complete
+    os.replace(tmp_path, path)
+
+
+@pytest.fixture(scope='session')
+def fast_alchemy_files(request):
+    rootdir = str(request.config.rootdir)
+    return [
+        os.path.join(rootdir, filename)
+        for filename in request.config.getini('fast_alchemy_files')
+    ]
+
+
+@pytest.fixture(scope='session')
+def fast_alchemy_template(fast_alchemy_files, tmp_path_factory):
+    from filelock import FileLock
+
+    root = tmp_path_factory.getbasetemp()
+    if os.environ.get('PYTEST_XDIST_WORKER'):
+        # xdist workers get their own temp dir in a shared one
+        root = root.parent
+    path = os.path.join(str(root), get_template_name(fast_alchemy_files))
+
+    with FileLock(path + '.lock'):
+        if not os.path.exists(path):
+            build_template(fast_alchemy_files, path)
+    return TemplateDatabase(path, path + MODELS_EXTENSION)
+
+
+@pytest.fixture(scope='session')
+def fast_alchemy_db(fast_alchemy_template, tmp_path_factory):
+    path = os.path.join(str(tmp_path_factory.mktemp('fast_alchemy')),
+                        'db.sqlite')
+    shutil.copyfile(fast_alchemy_template.path, path)
+
+    Base, session = create_session(path)
+    fa = FastAlchemy(Base, session, context_mode=SAVEPOINT)
+    with open(fast_alchemy_template.models_path, 'rb') as fh:
+        # the tables are already in the copied template
+        fa.load_models(pickle.load(fh), create=False)
+    yield fa
+    close_session(session)
+
+
+@pytest.fixture(scope='function')
+def fast_alchemy(fast_alchemy_db):
+    with fast_alchemy_db as fa:
+        yield fa
@@ -0,0 +1,55 @@
+import sqlite3
+
+import sqlalchemy as sa
+
+# the backup api is only available from python 3.7 onwards
+SQLITE_BACKUP = hasattr(sqlite3.Connection, 'backup')
+
+
+def get_dbapi_connection(session):
+    fairy = session.connection().connection
+    return getattr(fairy, 'driver_connection', None) or fairy.connection
+
+
+class SqliteSnapshot:
+    def __init__(self, session):
+        self.copy = sqlite3.connect(':memory:', check_same_thread=False)
+        get_dbapi_connection(session).backup(self.copy)
+
+    def restore(self, session):
+        self.copy.backup(get_dbapi_connection(session))
+
+    def close(self):
+        self.copy.close()
+
+
+class TableSnapshot:
+    def __init__(self, session, tables, batch_size=1000):
+        self.tables = sa.schema.sort_tables(tables)
+        self.batch_size = batch_size
+        self.rows = {}
+        for table in self.tables:
+            result = session.execute(table.select())
+            keys = list(result.keys())
+            self.rows[table] = [dict(zip(keys, row)) for row in result]
+
+    def restore(self, session):
+        for table in reversed(self.tables):
+            session.execute(table.delete())
+        for table in self.tables:
+            rows = self.rows[table]
+            for i in range(0, len(rows), self.batch_size):
+                session.execute(table.insert(), rows[i:i + self.batch_size])
+        session.commit()
+
+    def close(self):
+        self.rows = {}
+
+
+def take_snapshot(session, tables, batch_size=1000):
+    # snapshots only capture committed data
+    session.commit()
+    dialect = session.connection().dialect
+    if dialect.name == 'sqlite' and SQLITE_BACKUP:
+        return SqliteSnapshot(session)
+    return TableSnapshot(session, tables, batch_size)
@@ -0,0 +1,97 @@
+import csv
+import json
+import os
+
+from .helpers import iter_batches
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def get_pyarrow():
+    # pyarrow parses columns in native code, the stdlib is the fallback
+    try:
+        import pyarrow.csv
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def get_row(items):
+    # missing values are left out, so they don't end up in a relation
+    return {k: v for (k, v) in items if v is not None}
+
+
+def iter_columns(columns):
+    names = list(columns)
+    for values in zip(*[columns[name] for name in names]):
+        yield get_row(zip(names, values))
+
+
+def read_csv(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    pa = get_pyarrow()
+    if pa is not None:
+        with open(path, newline='') as fh:
+            names = next(csv.reader(fh), [])
+        # every column is read as text, like the stdlib does, the column
+        # types of the model decide what the values become
+        convert_options = pa.csv.ConvertOptions(
+            column_types=dict.fromkeys(names, pa.string()),
+            strings_can_be_null=True,
+            null_values=[''])
+        reader = pa.csv.open_csv(path, convert_options=convert_options)
+        for batch in reader:
+            for row in iter_columns(batch.to_pydict()):
+                yield row
+        return
+
+    with open(path, newline='') as fh:
+        reader = csv.reader(fh)
+        names = next(reader, [])
+        for rows in iter_batches(reader, chunk_size):
+            # empty cells are missing values
+            columns = {
+                name: [value if value != '' else None for value in values]
+                for (name, values) in zip(names, zip(*rows))
+            }
+            for row in iter_columns(columns):
+                yield row
+
+
+def read_ndjson(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    # json values carry their own type, and the file is read line by line
+    with open(path) as fh:
+        for line in fh:
+            if line.strip():
+                yield get_row(json.loads(line).items())
+
+
+def read_json(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    with open(path) as fh:
+        rows = json.load(fh)
+    if not isinstance(rows, list):
+        raise Exception('{} should hold a list of instances'.format(path))
+    for row in rows:
+        yield get_row(row.items())
+
+
+SOURCE_READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+    '.ndjson': read_ndjson,
+    '.jsonl': read_ndjson,
+}
+
+
+def resolve_source(source, filename=None):
+    # sources are relative to the file that points to them
+    if filename is None or os.path.isabs(source):
+        return source
+    return os.path.join(os.path.dirname(os.path.abspath(filename)), source)
+
+
+def read_source(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    ext = os.path.splitext(source)[-1]
+    if ext not in SOURCE_READERS:
+        msg = '{} is not a supported instance source, use one of {}'
+        raise Exception(msg.format(source, ', '.join(sorted(SOURCE_READERS))))
+    return SOURCE_READERS[ext](source, chunk_size)
@@ -0,0 +1,115 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+
+class PhaseStats:
+    def __init__(self, phase, model=None):
+        self.phase = phase
+        self.model = model
+        self.calls = 0
+        self.wall_time = 0.0
+        self.rows = 0
+        self.queries = 0
+        self.peak_instance_refs = 0
+
+    def add(self, other):
+        self.calls += other.calls
+        self.wall_time += other.wall_time
+        self.rows += other.rows
+        self.queries += other.queries
+        self.peak_instance_refs = max(self.peak_instance_refs,
+                                      other.peak_instance_refs)
+
+    def as_dict(self):
+        return OrderedDict([
+            ('phase', self.phase),
+            ('model', self.model),
+            ('calls', self.calls),
+            ('wall_time', self.wall_time),
+            ('rows', self.rows),
+            ('queries', self.queries),
+            ('peak_instance_refs', self.peak_instance_refs),
+        ])
+
+    def __repr__(self):
+        return '<PhaseStats {}{} {:.3f}s rows={} queries={}>'.format(
+            self.phase, ' ' + self.model if self.model else '',
+            self.wall_time, self.rows, self.queries)
+
+
+class LoadStats:
+    def __init__(self, on_phase_start=None, on_phase_end=None):
+        self.on_phase_start = on_phase_start
+        self.on_phase_end = on_phase_end
+        self._engines = []
+        self.reset()
+
+    def reset(self):
+        self.phases = OrderedDict()
+        self.peak_instance_refs = 0
+        self._active = []
+
+    def watch(self, bind):
+        engine = getattr(bind, 'engine', bind)
+        if engine is None or engine in self._engines:
+            return
+        sa.event.listen(engine, 'before_cursor_execute', self._count_query)
+        self._engines.append(engine)
+
+    def unwatch(self):
+        for engine in self._engines:
+            sa.event.remove(engine, 'before_cursor_execute', self._count_query)
+        self._engines = []
+
+    def _count_query(self, *args):
+        # queries count towards the innermost phase only
+        if self._active:
+            self._active[-1].queries += 1
+
+    @contextmanager
+    def phase(self, phase, model=None):
+        stats = self.phases.get((phase, model))
+        if stats is None:
+            stats = PhaseStats(phase, model)
+            self.phases[(phase, model)] = stats
+
+        if self.on_phase_start:
+            self.on_phase_start(phase, model)
+        self._active.append(stats)
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            elapsed = time.perf_counter() - start
+            self._active.pop()
+            if not self._active:
+                # queries outside of a phase aren't counted, so the engines
+                # are only listened to until the outermost phase ends
+                self.unwatch()
+            stats.calls += 1
+            stats.wall_time += elapsed
+            if self.on_phase_end:
+                self.on_phase_end(phase, model, elapsed)
+
+    def record_instance_refs(self, count):
+        self.peak_instance_refs = max(self.peak_instance_refs, count)
+        # unlike queries, a peak can't be counted twice by the outer phases
+        for stats in self._active:
+            stats.peak_instance_refs = max(stats.peak_instance_refs, count)
+
+    def by_phase(self):
+        totals = OrderedDict()
+        for stats in self.phases.values():
+            if stats.phase not in totals:
+                totals[stats.phase] = PhaseStats(stats.phase)
+            totals[stats.phase].add(stats)
+        return totals
+
+    def as_dict(self):
+        return OrderedDict([
+            ('peak_instance_refs', self.peak_instance_refs),
+            ('phases', [stats.as_dict() for stats in self.phases.values()]),
+        ])
@@ -0,0 +1,54 @@
+import asyncio
+import os
+
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.ext.declarative
+
+aiosqlite = pytest.importorskip('aiosqlite')
+asyncio_ext = pytest.importorskip('sqlalchemy.ext.asyncio')
+
+from fast_alchemy.aio import AsyncFastAlchemy  # noqa: E402
+
+ROOT_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+
+def test_it_can_load_with_an_async_session():
+    async def load(engine):
+        Base = sa.ext.declarative.declarative_base()
+        session = asyncio_ext.AsyncSession(engine, expire_on_commit=False)
+
+        fa = AsyncFastAlchemy(Base, session)
+        async with fa:
+            await fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+            result = await session.execute(sa.select(fa.AntColony))
+            assert len(result.scalars().all()) == 6
+
+            instances = await fa.load_instances(
+                os.path.join(DATA_DIR, 'single_model.yaml'),
+                auto_load=True,
+                ref_mapping={'Formicarium': 'name'})
+            session.add_all(instances.values())
+            await session.commit()
+            result = await session.execute(
+                sa.select(fa.AntColony).filter_by(name='Apomyrma'))
+            assert result.scalar_one().formicarium_id == 3
+
+        assert not fa.class_registry
+        async with engine.connect() as conn:
+            tables = await conn.run_sync(
+                lambda c: sa.inspect(c).get_table_names())
+        assert tables == []
+        await session.close()
+
+    async def run():
+        engine = asyncio_ext.create_async_engine('sqlite+aiosqlite://')
+        try:
+            await load(engine)
+        finally:
+            # the driver keeps a thread per connection
+            await engine.dispose()
+
+    asyncio.get_event_loop_policy().new_event_loop().run_until_complete(
+        run())
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.ext.declarative
+from fast_alchemy import FastAlchemy, FieldInfo, cache
+from fast_alchemy.cache import CachingFileLoader
+from fast_alchemy.helpers import load_file
+
+ROOT_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+
+@pytest.fixture(scope='function')
+def loader(tmpdir):
+    return CachingFileLoader(cache_dir=str(tmpdir))
+
+
+def test_it_caches_parsed_files(loader, monkeypatch):
+    path = os.path.join(DATA_DIR, 'instances.yaml')
+    raw = loader(path)
+    definition = raw['AntColony']['definition']
+    assert definition['formicarium'] == FieldInfo('formicarium',
+                                                  'relationship',
+                                                  ['Formicarium'])
+    assert raw['AntColony']['instances'] == load_file(
+        path)['AntColony']['instances']
+
+    def fail(*args, **kwargs):
+        raise AssertionError('yaml should not be parsed')
+
+    monkeypatch.setattr(cache, 'ordered_load', fail)
+    assert loader(path) == raw
+    assert loader(path) is not loader(path)
+
+
+def test_it_evicts_the_oldest_entries(tmpdir):
+    loader = CachingFileLoader(cache_dir=str(tmpdir), max_size=1)
+    loader(os.path.join(DATA_DIR, 'instances.yaml'))
+    loader(os.path.join(DATA_DIR, 'single_model.yaml'))
+    assert len(tmpdir.listdir()) == 0
+
+    loader.max_size = 1024 * 1024
+    loader(os.path.join(DATA_DIR, 'instances.yaml'))
+    loader(os.path.join(DATA_DIR, 'single_model.yaml'))
+    assert len(tmpdir.listdir()) == 2
+
+
+def test_it_can_load_from_the_cache(loader):
+    for _ in range(2):
+        engine = sa.create_engine('sqlite:///:memory:')
+        Base = sa.ext.declarative.declarative_base()
+        Base.metadata.bind = engine
+        Session = sa.orm.sessionmaker(
+            autocommit=False, autoflush=False, bind=engine)
+        session = sa.orm.scoped_session(Session)
+
+        fa = FastAlchemy(Base, session, file_loader=loader)
+        fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+        assert len(session.query(fa.SandwichFormicarium).all()) == 3
+        assert len(session.query(fa.AntColony).all()) == 6
+
+
+def test_it_keeps_the_cache_private(tmpdir, monkeypatch):
+    cache_dir = tmpdir.join('cache')
+    loader = CachingFileLoader(cache_dir=str(cache_dir))
+    loader(os.path.join(DATA_DIR, 'instances.yaml'))
+    assert cache_dir.stat().mode & 0o777 == 0o700
+
+    cache_dir.chmod(0o777)
+    with pytest.raises(Exception) as e:
+        loader(os.path.join(DATA_DIR, 'instances.yaml'))
+    assert 'can be written to by other users' in str(e.value)
+
+    cache_dir.chmod(0o700)
+    if hasattr(os, 'getuid'):
+        uid = os.getuid()
+        monkeypatch.setattr(os, 'getuid', lambda: uid + 1)
+        with pytest.raises(Exception) as e:
+            loader(os.path.join(DATA_DIR, 'instances.yaml'))
+        assert 'is not owned by the current user' in str(e.value)
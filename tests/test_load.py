@@ -1,11 +1,18 @@
+import copy
+import datetime
+import decimal
 import importlib
 import os
 import tempfile
+import time
 
 import pytest
 import sqlalchemy as sa
-from fast_alchemy import FastAlchemy, FlaskFastAlchemy
+from fast_alchemy import (ClassBuilder, FastAlchemy, FlaskFastAlchemy,
+                          snapshot, sources)
+from fast_alchemy import parallel as parallel_module
 from fast_alchemy.export import FastAlchemyExporter
+from fast_alchemy.helpers import load_file
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
@@ -78,6 +85,54 @@ def test_it_can_export_models_to_python_code(temp_file):
     assert len(session.query(module.AntColony).all()) == 6
 
 
+def test_it_can_use_a_class_builder_without_a_ref_argument():
+    built = []
+
+    class CustomClassBuilder(ClassBuilder):
+        def build_class(self, class_info, fields):
+            built.append(class_info.class_name)
+            return super().build_class(class_info, fields)
+
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+    fa = FastAlchemy(Base, session, class_builder=CustomClassBuilder)
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+    assert 'AntColony' in built
+    assert len(session.query(fa.AntColony).all()) == 6
+
+
+@pytest.mark.parametrize('kind', ['index', 'unique'])
+def test_it_can_index_the_ref_columns(kind, temp_file):
+    fa = FastAlchemyExporter(index_refs=kind)
+    with open(os.path.join(DATA_DIR, temp_file), 'w') as fh:
+        fa.export_to_python(os.path.join(DATA_DIR, 'instances.yaml'), fh)
+    spec = importlib.util.spec_from_file_location('models', temp_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    fa = FastAlchemy(Base, sa.orm.scoped_session(Session), index_refs=kind)
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+
+    for bind in (engine, module.engine):
+        inspector = sa.inspect(bind)
+        if kind == 'index':
+            indexes = inspector.get_indexes('antcollection')
+        else:
+            indexes = inspector.get_unique_constraints('antcollection')
+        assert [i['column_names'] for i in indexes] == [['name', 'location']]
+        # subclasses are looked up by the columns of their parent
+        assert not inspector.get_indexes('sandwichformicarium')
+
+
 def test_it_can_preloads_the_relations():
     engine = sa.create_engine('sqlite:///:memory:')
     Base = sa.ext.declarative.declarative_base()
@@ -94,3 +149,976 @@ def test_it_can_preloads_the_relations():
         os.path.join(DATA_DIR, 'single_model.yaml'),
         auto_load=True,
         ref_mapping={'Formicarium': 'name'})
+
+
+def dump_tables(fa):
+    tables = fa.Model.metadata.sorted_tables
+    return {
+        table.name: fa.session.execute(table.select()).fetchall()
+        for table in tables
+    }
+
+
+def test_it_can_bulk_load_instances():
+    dumps = []
+    for bulk in (False, True):
+        engine = sa.create_engine('sqlite:///:memory:')
+        Base = sa.ext.declarative.declarative_base()
+        Base.metadata.bind = engine
+        Session = sa.orm.sessionmaker(
+            autocommit=False, autoflush=False, bind=engine)
+        session = sa.orm.scoped_session(Session)
+
+        fa = FastAlchemy(Base, session)
+        fa.load(os.path.join(DATA_DIR, 'instances.yaml'), bulk=bulk)
+        dumps.append(dump_tables(fa))
+
+    assert dumps[0] == dumps[1]
+    assert len(dumps[1]['formicarium']) == 5
+    assert len(dumps[1]['sandwichformicarium']) == 3
+
+
+def test_it_can_insert_independent_tables_in_parallel(tmpdir, monkeypatch):
+    def get_fast_alchemy(name):
+        path = tmpdir.join(name)
+        engine = sa.create_engine('sqlite:///{}'.format(path))
+        sa.event.listen(
+            engine, 'connect',
+            lambda conn, record: conn.execute('PRAGMA journal_mode=WAL'))
+        Base = sa.ext.declarative.declarative_base()
+        Session = sa.orm.sessionmaker(
+            autocommit=False, autoflush=False, bind=engine)
+        return FastAlchemy(Base, sa.orm.scoped_session(Session), workers=2)
+
+    dumps = []
+    for parallel in (False, True):
+        fa = get_fast_alchemy('db_{}.sqlite'.format(parallel))
+        fa.load(os.path.join(DATA_DIR, 'instances.yaml'), parallel=parallel)
+        dumps.append(dump_tables(fa))
+    assert dumps[0] == dumps[1]
+
+    insert_table = parallel_module.ParallelInserter.insert_table
+
+    def fail_on_colonies(inserter, table, rows):
+        if table.name == 'antcolony':
+            raise Exception('disk full')
+        insert_table(inserter, table, rows)
+
+    monkeypatch.setattr(parallel_module.ParallelInserter, 'insert_table',
+                        fail_on_colonies)
+    fa = get_fast_alchemy('db_failing.sqlite')
+    with pytest.raises(Exception) as e:
+        fa.load(os.path.join(DATA_DIR, 'instances.yaml'), parallel=True)
+    assert str(e.value) == ('Nothing was loaded, inserting failed for:\n'
+                            '    antcolony: disk full')
+    assert not any(dump_tables(fa).values())
+
+
+def test_it_takes_turns_writing_to_sqlite(tmpdir, monkeypatch):
+    # a short busy timeout, so waiting on the sqlite lock would fail
+    engine = sa.create_engine(
+        'sqlite:///{}'.format(tmpdir.join('db.sqlite')),
+        connect_args={'timeout': 0.05})
+    Base = sa.ext.declarative.declarative_base()
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    fa = FastAlchemy(Base, sa.orm.scoped_session(Session), workers=2)
+
+    execute = parallel_module.BulkInserter.execute
+
+    def slow_execute(inserter, table, rows):
+        execute(inserter, table, rows)
+        if table.name == 'sandwichformicarium':
+            time.sleep(0.3)
+
+    monkeypatch.setattr(parallel_module.BulkInserter, 'execute', slow_execute)
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'), parallel=True)
+    assert len(fa.session.query(fa.FreeStandingFormicarium).all()) == 2
+    assert len(fa.session.query(fa.SandwichFormicarium).all()) == 3
+
+
+def test_it_can_export_instances_as_sql_and_csv(tmpdir):
+    dumps = []
+    for export in (False, True):
+        engine = sa.create_engine('sqlite:///:memory:')
+        Base = sa.ext.declarative.declarative_base()
+        Base.metadata.bind = engine
+        Session = sa.orm.sessionmaker(
+            autocommit=False, autoflush=False, bind=engine)
+        session = sa.orm.scoped_session(Session)
+
+        fa = FastAlchemy(Base, session)
+        if not export:
+            fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+            dumps.append(dump_tables(fa))
+            continue
+
+        sql_file = tmpdir.join('instances.sql')
+        with open(str(sql_file), 'w') as fh:
+            FastAlchemyExporter().export_instances(
+                os.path.join(DATA_DIR, 'instances.yaml'),
+                sql_file=fh,
+                csv_dir=str(tmpdir.join('csv')))
+        fa.load_models(os.path.join(DATA_DIR, 'instances.yaml'))
+        connection = engine.raw_connection()
+        connection.executescript(sql_file.read())
+        connection.close()
+        dumps.append(dump_tables(fa))
+
+    assert dumps[0] == dumps[1]
+    with open(str(tmpdir.join('csv', 'sandwichformicarium.csv'))) as fh:
+        assert fh.read().splitlines() == [
+            'id,height', '1,10', '3,10', '5,15'
+        ]
+
+
+def test_it_reloads_only_the_changed_instances():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    statements = []
+    sa.event.listen(engine, 'before_cursor_execute',
+                    lambda *args: statements.append(args[2].split()[0]))
+
+    raw = load_file(os.path.join(DATA_DIR, 'instances.yaml'))
+    fa = FastAlchemy(Base, session)
+    fa.load(copy.deepcopy(raw))
+    # instances loaded before are updated once, the next reload is a no-op
+    fa.load_incremental(copy.deepcopy(raw))
+    del statements[:]
+    fa.load_incremental(copy.deepcopy(raw))
+    assert statements == []
+
+    colonies = raw['AntColony']['instances']
+    colonies[4]['color'] = 'orange'
+    colonies.pop(5)
+    colonies.append({'name': 'Pharaoh Ant', 'formicarium': 'Specimen-2'})
+    raw['SandwichFormicarium|Formicarium']['instances'][2]['height'] = 12
+    fa.stats.reset()
+    fa.load_incremental(copy.deepcopy(raw), delete=True)
+    # one statement per table, besides looking up the next primary key
+    assert statements == [
+        'SELECT', 'INSERT', 'UPDATE', 'UPDATE', 'UPDATE', 'DELETE'
+    ]
+
+    colonies = {c.name: c for c in session.query(fa.AntColony)}
+    assert sorted(colonies) == [
+        'Argentine Ant', 'Black House Ant', 'Bulldog Ant', 'Carpenter Ant',
+        'Fire Ant', 'Pharaoh Ant'
+    ]
+    assert colonies['Fire Ant'].color == 'orange'
+    assert colonies['Fire Ant'].formicarium.name == 'The Free SociAnty'
+    assert colonies['Pharaoh Ant'].formicarium.height == 15
+    pants = session.query(fa.Formicarium).filter_by(name='PAnts').one()
+    assert pants.height == 12
+    assert pants.collection.name == 'Antics'
+    assert fa.stats.by_phase()['diff'].rows == 3
+    assert fa.stats.by_phase()['delete'].rows == 1
+
+
+def test_it_reloads_changed_many_to_many_relations():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    raw = load_file(os.path.join(DATA_DIR, 'many_to_many.yaml'))
+    fa = FastAlchemy(Base, session)
+    fa.load_incremental(copy.deepcopy(raw))
+
+    colonies = raw['AntColony']['instances']
+    colonies.pop(0)
+    colonies[0]['tags'] = ['biting']
+    colonies[1]['tags'] = ['garden']
+    raw['Tag']['instances'].append({'name': 'garden'})
+    fa.load_incremental(copy.deepcopy(raw), delete=True)
+
+    tags = {
+        c.name: [t.name for t in c.tags]
+        for c in session.query(fa.AntColony)
+    }
+    assert tags == {'Fire Ant': ['biting'], 'Garden Ant': ['garden']}
+    secondary = Base.metadata.tables['antcolony_tags']
+    assert len(session.execute(secondary.select()).fetchall()) == 2
+
+
+@pytest.mark.parametrize('options', [{}, {
+    'bulk': True
+}, {
+    'stream': True
+}])
+def test_it_can_load_many_to_many_relations(options):
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load(os.path.join(DATA_DIR, 'many_to_many.yaml'), **options)
+    colonies = {c.name: c for c in session.query(fa.AntColony)}
+    assert sorted(t.name for t in colonies['Fire Ant'].tags) == [
+        'biting', 'invasive'
+    ]
+    assert colonies['Garden Ant'].tags == []
+    invasive = session.query(fa.Tag).filter_by(name='invasive').one()
+    assert len(invasive.colonies) == 2
+    assert fa.stats.by_phase()['associate'].rows == 4
+
+    fa.drop_models(models=['Tag'])
+    assert list(Base.metadata.tables) == ['antcolony']
+    assert not hasattr(fa.AntColony, 'tags')
+
+
+@pytest.mark.parametrize('options', [{}, {'bulk': True}])
+def test_it_can_load_many_to_many_relations_to_later_models(options):
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    raw = load_file(os.path.join(DATA_DIR, 'many_to_many.yaml'))
+    raw.move_to_end('Tag')
+    fa = FastAlchemy(Base, session)
+    fa.load(raw, **options)
+    colony = session.query(fa.AntColony).filter_by(name='Fire Ant').one()
+    assert sorted(t.name for t in colony.tags) == ['biting', 'invasive']
+
+
+@pytest.mark.parametrize('options', [{}, {'bulk': True}])
+def test_it_can_load_many_to_many_relations_to_the_same_model(
+        options, temp_file):
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load(os.path.join(DATA_DIR, 'self_many_to_many.yaml'), **options)
+    ants = {a.name: a for a in session.query(fa.Ant)}
+    assert sorted(a.name for a in ants['Queen'].friends) == [
+        'Soldier', 'Worker'
+    ]
+    assert [a.name for a in ants['Worker'].friends] == ['Soldier']
+    assert ants['Soldier'].friends == []
+
+    fa = FastAlchemyExporter()
+    with open(temp_file, 'w') as fh:
+        fa.export_to_python(
+            os.path.join(DATA_DIR, 'self_many_to_many.yaml'), fh)
+    spec = importlib.util.spec_from_file_location('models', temp_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    fa = FastAlchemy(module.Base, module.session)
+    instances = fa.load_instances(
+        os.path.join(DATA_DIR, 'self_many_to_many.yaml'))
+    module.session.add_all(instances.values())
+    fa.insert_associations()
+    module.session.commit()
+    queen = module.session.query(module.Ant).filter_by(name='Queen').one()
+    assert sorted(a.name for a in queen.friends) == ['Soldier', 'Worker']
+
+
+@pytest.mark.parametrize('pyarrow', [True, False])
+@pytest.mark.parametrize('options', [{}, {'bulk': True, 'stream': True}])
+def test_it_can_load_instances_from_external_sources(
+        pyarrow, options, monkeypatch):
+    if pyarrow:
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(sources, 'get_pyarrow', lambda: None)
+
+    dumps = []
+    for filename in ('instances.yaml', 'sources.yaml'):
+        engine = sa.create_engine('sqlite:///:memory:')
+        Base = sa.ext.declarative.declarative_base()
+        Base.metadata.bind = engine
+        Session = sa.orm.sessionmaker(
+            autocommit=False, autoflush=False, bind=engine)
+        session = sa.orm.scoped_session(Session)
+
+        fa = FastAlchemy(Base, session)
+        fa.load(os.path.join(DATA_DIR, filename), **options)
+        dumps.append(dump_tables(fa))
+
+    assert dumps[0] == dumps[1]
+
+
+@pytest.mark.parametrize('pyarrow', [True, False])
+def test_it_reads_csv_values_as_text(pyarrow, tmpdir, monkeypatch):
+    if pyarrow:
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(sources, 'get_pyarrow', lambda: None)
+    path = tmpdir.join('codes.csv')
+    path.write('code,size\n007,1.10\n1.10,NA\n')
+
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load({
+        'Code': {
+            'ref': 'code',
+            'definition': {
+                'code': 'String',
+                'size': 'String'
+            },
+            'instances': str(path)
+        }
+    })
+    assert sorted((c.code, c.size) for c in session.query(fa.Code)) == [
+        ('007', '1.10'), ('1.10', 'NA')
+    ]
+
+
+def test_it_coerces_values_to_the_column_types():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    def get_raw(*instances):
+        return {
+            'Feeding': {
+                'ref': 'fed_on,grams',
+                'definition': {
+                    'fed_on': 'Date',
+                    'fed_at': 'DateTime',
+                    'grams': 'Numeric',
+                    'sugar': 'Boolean',
+                    'food': 'Enum|seeds,insects',
+                },
+                'instances': list(instances),
+            }
+        }
+
+    fa = FastAlchemy(Base, session)
+    fa.load(
+        get_raw({
+            'fed_on': '2020-01-01',
+            'fed_at': '2020-01-01 10:30:00',
+            'grams': '1.25',
+            'sugar': 'yes',
+            'food': 'seeds',
+        }))
+    feeding = session.query(fa.Feeding).one()
+    assert feeding.fed_on == datetime.date(2020, 1, 1)
+    assert feeding.fed_at == datetime.datetime(2020, 1, 1, 10, 30)
+    assert feeding.grams == decimal.Decimal('1.25')
+    assert feeding.sugar is True
+
+    # existing instances are found by their typed ref, a numeric column
+    # hands back 1.25 as 1.2500000000
+    instances = fa.load_instances(
+        get_raw({
+            'fed_on': '2020-01-01',
+            'grams': 1.25
+        }))
+    assert list(instances.values()) == [feeding]
+
+    with pytest.raises(Exception) as e:
+        fa.load_instances(
+            get_raw({
+                'fed_on': '2020-13-01',
+                'sugar': 'maybe'
+            }, {
+                'fed_on': '2020-01-02',
+                'food': 'leaves'
+            }))
+    assert str(e.value).splitlines()[:4] == [
+        'Could not convert 3 values:',
+        "    Feeding instance 1, fed_on: '2020-13-01' (expected a format "
+        "like %Y-%m-%d)",
+        "    Feeding instance 1, sugar: 'maybe' (expected one of true, yes, "
+        "on, 1, false, no, off, 0)",
+        "    Feeding instance 2, food: 'leaves' (expected one of seeds, "
+        "insects)",
+    ]
+
+
+@pytest.mark.parametrize('size_type', ['Float', 'Numeric'])
+def test_it_coerces_the_refs_of_relations(size_type):
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load({
+        'Box': {
+            'ref': 'name,size',
+            'definition': {
+                'name': 'String',
+                'size': size_type,
+                'items': 'Backref|Item'
+            },
+            'instances': [{
+                'name': 'a',
+                'size': 10
+            }, {
+                'name': 'a',
+                'size': '2.5'
+            }]
+        },
+        'Item': {
+            'ref': 'name',
+            'definition': {
+                'name': 'String',
+                'box': 'relationship|Box'
+            },
+            'instances': [{
+                'name': 'ant',
+                'box': 'a,10'
+            }, {
+                'name': 'bee',
+                'box': 'a, 2.5'
+            }]
+        }
+    })
+    items = {i.name: i for i in session.query(fa.Item)}
+    assert items['ant'].box.size == 10
+    assert items['bee'].box.size == decimal.Decimal('2.5')
+
+
+def test_it_can_bulk_load_next_to_existing_instances():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'), bulk=True)
+    instances = fa.load_instances(
+        os.path.join(DATA_DIR, 'single_model.yaml'),
+        auto_load=True,
+        ref_mapping={'Formicarium': 'name'})
+    fa.bulk_insert(instances.values())
+    session.commit()
+
+    colony = session.query(fa.AntColony).filter_by(name='Apomyrma').one()
+    assert colony.id == 7
+    assert colony.formicarium.name == 'PAnts'
+
+
+def test_it_preloads_existing_instances_in_chunks():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+    statements = []
+
+    @sa.event.listens_for(engine, 'before_cursor_execute')
+    def track(conn, cursor, statement, *args):
+        if statement.startswith('SELECT'):
+            statements.append(statement)
+
+    fa = FastAlchemy(Base, session, chunk_size=3)
+    fa.load(os.path.join(DATA_DIR, 'relation_ref.yaml'))
+    statements[:] = []
+    instances = fa.load_instances(
+        os.path.join(DATA_DIR, 'relation_ref.yaml'))
+
+    assert all(sa.inspect(i).persistent for i in instances.values())
+    assert 'Formicarium|Specimen-1,Antopia,My bedroom' in instances
+    # 2 collections and 3 formicaria, at most 3 parameters per query
+    assert len(statements) == 2 + 3
+    assert not any('EXISTS' in statement for statement in statements)
+
+
+def test_it_auto_loads_relations_in_batches():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+    fa = FastAlchemy(Base, session)
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+
+    statements = []
+
+    @sa.event.listens_for(engine, 'before_cursor_execute')
+    def track(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    formicaria = ['Specimen-1', 'Specimen-2', 'PAnts', 'The yard yokels']
+    colonies = [{
+        'name': 'Colony {}'.format(i),
+        'formicarium': formicaria[i % len(formicaria)]
+    } for i in range(1000)]
+    raw = {'AntColony': {'ref': 'name', 'instances': colonies}}
+    instances = fa.load_instances(
+        raw, auto_load=True, ref_mapping={'Formicarium': 'name'})
+
+    # two chunks to find existing colonies, one for the formicaria
+    assert len(statements) == 3
+    assert instances['AntColony|Colony 2'].formicarium.name == 'PAnts'
+
+
+@pytest.mark.parametrize('coerce_types', [True, False])
+@pytest.mark.parametrize('size_type', ['Numeric', 'Float'])
+def test_it_auto_loads_relations_by_decimal_refs(size_type, coerce_types):
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+    fa = FastAlchemy(Base, session, coerce_types=coerce_types)
+    fa.load({
+        'Box': {
+            'ref': 'size',
+            'definition': {
+                'size': size_type,
+                'items': 'Backref|Item'
+            },
+            'instances': [{
+                'size': '2.5'
+            }, {
+                'size': '10'
+            }]
+        },
+        'Item': {
+            'ref': 'name',
+            'definition': {
+                'name': 'String',
+                'box': 'relationship|Box'
+            }
+        }
+    })
+
+    raw = {
+        'Item': {
+            'ref': 'name',
+            'instances': [{
+                'name': 'ant',
+                'box': '2.5'
+            }, {
+                'name': 'bee',
+                'box': '10'
+            }]
+        }
+    }
+    instances = fa.load_instances(
+        raw, auto_load=True, ref_mapping={'Box': 'size'})
+    assert instances['Item|ant'].box.size == 2.5
+    assert instances['Item|bee'].box.size == 10
+
+
+def test_it_caches_model_info_until_the_models_change():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load_models(os.path.join(DATA_DIR, 'instances.yaml'))
+    info = fa.get_model_info(fa.Formicarium, 'name')
+    assert info is fa.get_model_info(fa.Formicarium)
+    assert info.ref_keys == ('name', )
+    assert info.many_to_one == (('collection', 'AntCollection'), )
+    assert info.relation_names == {'collection', 'colonies'}
+
+    fa.load_models({'Tag': {'definition': {'name': 'String'}}})
+    assert info is not fa.get_model_info(fa.Formicarium)
+    info = fa.get_model_info(fa.Formicarium)
+    fa.drop_models(models=['Tag'])
+    assert info is not fa.get_model_info(fa.Formicarium)
+
+
+def test_it_can_stream_instances_in_batches():
+    relations = []
+    for stream in (False, True):
+        engine = sa.create_engine('sqlite:///:memory:')
+        Base = sa.ext.declarative.declarative_base()
+        Base.metadata.bind = engine
+        Session = sa.orm.sessionmaker(
+            autocommit=False, autoflush=False, bind=engine)
+        session = sa.orm.scoped_session(Session)
+
+        fa = FastAlchemy(Base, session, batch_size=2)
+        fa.load(os.path.join(DATA_DIR, 'instances.yaml'), stream=stream)
+        relations.append({(c.name, c.formicarium.name,
+                           c.formicarium.collection.location)
+                          for c in session.query(fa.AntColony)})
+
+    assert relations[0] == relations[1]
+    assert len(relations[1]) == 6
+    assert len(session.query(fa.SandwichFormicarium).all()) == 3
+
+
+def test_it_keeps_only_primary_keys_when_streaming():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session, batch_size=2)
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+    refs = fa.load_stream(
+        os.path.join(DATA_DIR, 'single_model.yaml'),
+        auto_load=True,
+        bulk=True,
+        ref_mapping={'Formicarium': 'name'})
+
+    assert refs == {'AntColony|Apomyrma': (7, ), 'Formicarium|PAnts': (3, )}
+    assert not session.identity_map
+    colony = session.query(fa.AntColony).get(7)
+    assert colony.formicarium.name == 'PAnts'
+
+
+@pytest.mark.parametrize('snapshot_type', ['SqliteSnapshot', 'TableSnapshot'])
+def test_it_can_restore_a_snapshot(snapshot_type, tmpdir, monkeypatch):
+    if snapshot_type == 'TableSnapshot':
+        monkeypatch.setattr(snapshot, 'SQLITE_BACKUP', False)
+    engine = sa.create_engine('sqlite:///{}'.format(tmpdir.join('db.sqlite')))
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+    state = fa.snapshot()
+    assert type(state).__name__ == snapshot_type
+    expected = dump_tables(fa)
+
+    for _ in range(2):
+        session.query(fa.AntColony).delete()
+        fa.load_instances(
+            os.path.join(DATA_DIR, 'single_model.yaml'),
+            auto_load=True,
+            ref_mapping={'Formicarium': 'name'})
+        session.commit()
+        assert dump_tables(fa) != expected
+
+        fa.restore(state)
+        assert dump_tables(fa) == expected
+        assert len(session.query(fa.AntColony).all()) == 6
+
+
+def test_it_can_use_savepoints_as_context():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+    fa = FastAlchemy(Base, session, context_mode='savepoint')
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+    statements = []
+
+    @sa.event.listens_for(engine, 'before_cursor_execute')
+    def track(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with fa:
+        fa.load_instances(
+            os.path.join(DATA_DIR, 'single_model.yaml'),
+            auto_load=True,
+            ref_mapping={'Formicarium': 'name'})
+        session.commit()
+        assert len(session.query(fa.AntColony).all()) == 7
+        with fa:
+            session.query(fa.AntColony).delete()
+            session.commit()
+            assert len(session.query(fa.AntColony).all()) == 0
+        assert len(session.query(fa.AntColony).all()) == 7
+    assert len(session.query(fa.AntColony).all()) == 6
+    assert not any('DROP' in statement for statement in statements)
+    assert 'AntColony' in fa.class_registry
+
+    with fa:
+        fa.load_models({'Tag': {'definition': {'name': 'String'}}})
+        assert 'tag' in sa.inspect(session.connection()).get_table_names()
+    assert 'Tag' not in fa.class_registry
+    assert 'tag' not in sa.inspect(engine).get_table_names()
+
+
+def test_it_builds_lazy_models_on_first_access():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load_models(os.path.join(DATA_DIR, 'instances.yaml'), lazy=True)
+    assert not fa.class_registry
+    assert not sa.inspect(engine).get_table_names()
+
+    # the related models and the ones holding a backref come along
+    assert fa.AntColony.__tablename__ == 'antcolony'
+    assert sorted(fa.class_registry) == [
+        'AntCollection', 'AntColony', 'Formicarium'
+    ]
+    assert sorted(sa.inspect(engine).get_table_names()) == [
+        'antcollection', 'antcolony', 'formicarium'
+    ]
+    assert fa.stats.by_phase()['build_models'].calls == 3
+
+    assert fa.class_registry['SandwichFormicarium'].height
+    with pytest.raises(AttributeError):
+        fa.Unknown
+
+    instances = fa.load_instances(os.path.join(DATA_DIR, 'instances.yaml'))
+    assert not fa._lazy_models
+    session.add_all(instances.values())
+    session.commit()
+    assert len(session.query(fa.AntColony).all()) == 6
+
+
+def test_it_discards_lazy_models_with_their_context():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    with fa:
+        fa.load_models(os.path.join(DATA_DIR, 'instances.yaml'), lazy=True)
+        assert fa.AntColony
+    assert not hasattr(fa, 'SandwichFormicarium')
+    assert not fa.class_registry
+    assert not sa.inspect(engine).get_table_names()
+
+    fa.load_models(os.path.join(DATA_DIR, 'instances.yaml'), lazy=True)
+    assert fa.AntColony
+    fa.drop_models()
+    assert not hasattr(fa, 'SandwichFormicarium')
+    assert not sa.inspect(engine).get_table_names()
+
+    fa.load_models({'Broken': {'definition': {'name': 'Unknown'}}}, lazy=True)
+    assert not hasattr(fa, 'Broken')
+
+
+def test_it_only_unloads_the_dropped_models():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+    formicarium = fa.Formicarium
+    fa.drop_models(models=['AntColony'])
+    assert not hasattr(formicarium, 'colonies')
+    assert 'antcolony' not in Base.metadata.tables
+    sandwich = session.query(fa.SandwichFormicarium).filter_by(
+        name='PAnts').one()
+    assert sandwich.collection.name == 'Antics'
+
+    # subclasses are dropped along with their parent
+    fa.drop_models(models=['Formicarium'])
+    assert list(fa.class_registry) == ['AntCollection']
+    assert list(Base.metadata.tables) == ['antcollection']
+    assert not hasattr(fa.AntCollection, 'formicaria')
+    assert len(session.query(fa.AntCollection).all()) == 4
+
+
+def test_it_reuses_memoized_models():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session, memoize_models=True)
+    with fa:
+        fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+        classes = dict(fa.class_registry)
+    assert not fa.class_registry
+    assert not Base.metadata.tables
+
+    with fa:
+        fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+        assert fa.class_registry == classes
+        assert len(session.query(fa.SandwichFormicarium).all()) == 3
+        assert len(session.query(fa.AntColony).all()) == 6
+        session.close()
+
+    # a changed model is rebuilt along with the models related to it
+    raw = fa._load_file(os.path.join(DATA_DIR, 'instances.yaml'))
+    raw['AntCollection']['definition']['owner'] = 'String'
+    with fa:
+        fa.load(raw)
+        assert fa.AntCollection is not classes['AntCollection']
+        assert fa.Formicarium is not classes['Formicarium']
+        assert len(session.query(fa.AntColony).all()) == 6
+        collection = session.query(fa.AntCollection).first()
+        assert collection.owner is None
+        assert collection.formicaria
+
+
+def test_it_resolves_forward_references_in_one_pass():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session)
+    fa.load_models({
+        'Ant': {
+            'definition': {
+                'name': 'String',
+                'ant_type': 'String',
+                'ruled_colonies': 'Backref|Colony',
+                'polymorphic': {
+                    'on': 'ant_type'
+                },
+            }
+        },
+        'Colony': {
+            'definition': {
+                'name': 'String',
+                'queen': 'relationship|Ant',
+                'workers': 'Backref|Worker',
+            }
+        },
+        'Worker|Ant': {
+            'definition': {
+                'colony': 'relationship|Colony'
+            }
+        }
+    })
+    raw = {
+        'Worker': {
+            'ref': 'name',
+            'instances': [
+                {'name': 'Worker', 'colony': 'Antopia'},
+                {'name': 'Queen', 'colony': 'Nomants'},
+            ]
+        },
+        'Colony': {
+            'ref': 'name',
+            'instances': [
+                {'name': 'Antopia', 'queen': 'Queen'},
+                {'name': 'Nomants'},
+            ]
+        },
+    }
+    instances = fa.load_instances(raw)
+    session.add_all(instances.values())
+    session.commit()
+    worker = session.query(fa.Worker).filter_by(name='Worker').one()
+    assert worker.colony.queen.colony.name == 'Nomants'
+
+    raw['Colony']['instances'][1]['queen'] = 'Queen'
+    with pytest.raises(Exception) as e:
+        fa.load_instances(raw)
+    assert str(e.value) == ('Circular references between Worker|Worker, '
+                            'Worker|Queen, Colony|Antopia, Colony|Nomants')
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_it_can_generate_instances(stream):
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    fa = FastAlchemy(Base, session, batch_size=100)
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+    path = os.path.join(DATA_DIR, 'generated.yaml')
+    ref_mapping = {'Formicarium': 'name', 'SandwichFormicarium': 'name'}
+    if stream:
+        fa.load_stream(
+            path, auto_load=True, bulk=True, ref_mapping=ref_mapping)
+    else:
+        instances = fa.load_instances(
+            path, auto_load=True, ref_mapping=ref_mapping)
+        session.add_all(instances.values())
+        session.commit()
+
+    colonies = session.query(fa.AntColony).filter(
+        fa.AntColony.name.like('Colony %')).all()
+    assert len(colonies) == 250
+    assert {c.color for c in colonies} == {'black', 'brown', 'red'}
+    assert {c.worker_size for c in colonies} == {1, 2, 3}
+    assert all(1.5 <= c.queen_size <= 3.0 for c in colonies)
+    colony = session.query(fa.AntColony).filter_by(name='Colony 3').one()
+    assert colony.formicarium.name == 'Specimen-1'
+    apomyrma = session.query(fa.AntColony).filter_by(name='Apomyrma').one()
+    assert apomyrma.formicarium.name == 'Specimen-2'
+
+
+def test_it_records_stats_per_phase():
+    engine = sa.create_engine('sqlite:///:memory:')
+    Base = sa.ext.declarative.declarative_base()
+    Base.metadata.bind = engine
+    Session = sa.orm.sessionmaker(
+        autocommit=False, autoflush=False, bind=engine)
+    session = sa.orm.scoped_session(Session)
+
+    calls = []
+    fa = FastAlchemy(
+        Base,
+        session,
+        on_phase_start=lambda phase, model: calls.append(('start', phase)),
+        on_phase_end=lambda phase, model, elapsed: calls.append(
+            ('end', phase)))
+    fa.load(os.path.join(DATA_DIR, 'instances.yaml'))
+
+    phases = fa.stats.by_phase()
+    assert list(phases) == [
+        'parse', 'build_models', 'create_models', 'coerce', 'pre_load',
+        'sort_instances', 'build_instances', 'insert', 'commit'
+    ]
+    assert phases['build_models'].calls == 5
+    assert phases['build_instances'].rows == 15
+    assert phases['pre_load'].queries == 4
+    assert phases['commit'].queries > 0
+    assert fa.stats.phases[('build_instances', 'AntColony')].rows == 6
+    assert fa.stats.peak_instance_refs == 15
+    assert phases['build_instances'].peak_instance_refs == 15
+    assert phases['commit'].peak_instance_refs == 0
+    build_stats = fa.stats.phases[('build_instances', 'AntCollection')]
+    assert build_stats.peak_instance_refs == 4
+    assert build_stats.as_dict()['peak_instance_refs'] == 4
+    assert calls[:2] == [('start', 'parse'), ('end', 'parse')]
+    assert len(calls) == 2 * sum(p.calls for p in phases.values())
+    assert not sa.event.contains(engine, 'before_cursor_execute',
+                                 fa.stats._count_query)
+
+    fa.stats.reset()
+    assert not fa.stats.phases
@@ -0,0 +1,38 @@
+import os
+import shutil
+
+ROOT_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+pytest_plugins = ['pytester']
+
+
+def test_it_provides_fast_alchemy_from_a_template(testdir):
+    shutil.copy(os.path.join(DATA_DIR, 'instances.yaml'), str(testdir.tmpdir))
+    testdir.makeini("""
+        [pytest]
+        fast_alchemy_files = instances.yaml
+    """)
+    testdir.makepyfile("""
+        import os
+
+        import pytest
+
+
+        @pytest.mark.parametrize('run', range(3))
+        def test_it_rolls_back(fast_alchemy, run):
+            fa = fast_alchemy
+            assert len(fa.session.query(fa.AntColony).all()) == 6
+            sandwich = fa.session.query(fa.SandwichFormicarium).first()
+            assert sandwich.collection.name == 'Antopia'
+            fa.session.add(fa.AntColony(name='Run{}'.format(run)))
+            fa.session.commit()
+            assert len(fa.session.query(fa.AntColony).all()) == 7
+
+
+        def test_it_skips_the_ddl(fast_alchemy_db, fast_alchemy_template):
+            assert os.path.exists(fast_alchemy_template.path)
+            assert 'AntColony' in fast_alchemy_db.class_registry
+    """)
+    result = testdir.runpytest('-p', 'fast_alchemy.pytest_plugin')
+    result.assert_outcomes(passed=4)